@@ -7,6 +7,7 @@
 # results back to a standard summary statistics format
 
 import argparse
+import glob
 import logging
 import time
 import sys
@@ -16,6 +17,17 @@ import getpass
 import six
 import os
 import json
+import re
+import multiprocessing
+import pickle
+import shutil
+import struct
+import zlib
+import concurrent.futures
+import functools
+import hashlib
+import resource
+import subprocess
 import yaml
 import pandas as pd
 import numpy as np
@@ -127,6 +139,13 @@ def parse_args(args):
                               help="filename(s) with IID identifiers to remove from GWAS analysis;  this option takes "
                               "precedence over --remove option, i.e. when both lists are provided, an individual will "
                               "be removed as long as it's specified in --remove list (even if it's present in --keep)")
+    pheno_parser.add_argument("--pheno-cache", type=str, default=None,
+                              help="folder to cache parsed --pheno-file in parquet format, so that subsequent runs "
+                              "with the same --pheno-file and --dict-file (same path, size and modification time) "
+                              "load only the required columns from the cache instead of parsing the text file")
+    pheno_parser.add_argument("--pheno-cache-size", type=float, default=20,
+                              help="maximum size (in GB) of --pheno-cache folder; least recently used files are "
+                              "removed when the cache exceeds this size")
     pheno_parser.add_argument('--config', type=str, default="config.yaml", help="file with misc configuration options")
 
     # filtering options
@@ -154,19 +173,47 @@ def parse_args(args):
     filter_parser.add_argument("--exclude-step2", type=str, default=None,
                                help="File with a set of SNPs to to exclude from regenie analysis' step2")
 
+    # options for executing generated jobs
+    executor_parser = argparse.ArgumentParser(add_help=False)
+    executor_parser.add_argument("--executor", type=str, default='slurm', choices=['slurm', 'local'],
+                                 help="'slurm' generates SLURM jobs and prints sbatch commands to submit them; "
+                                 "'local' runs the same jobs on the current machine, with tasks of job arrays "
+                                 "(e.g. chromosomes) executed concurrently, and exits with an error if any task fails")
+    executor_parser.add_argument("--jobs", type=int, default=None,
+                                 help="maximum number of tasks to run concurrently with '--executor local'; "
+                                 "it can only lower the limit derived from --local-cpus and --local-mem")
+    executor_parser.add_argument("--local-cpus", type=int, default=os.cpu_count(),
+                                 help="number of CPUs available to '--executor local'; each task reserves "
+                                 "cpus_per_task CPUs as configured for SLURM in --config file")
+    executor_parser.add_argument("--local-mem", type=float, default=None,
+                                 help="memory (in GB) available to '--executor local', defaults to physical memory; "
+                                 "each task reserves cpus_per_task x mem_per_cpu as configured in --config file")
+    executor_parser.add_argument("--resume", action="store_true", default=False,
+                                 help="generate only missing or stale jobs (and tasks of job arrays), i.e. those "
+                                 "without <out>.<job>[.<task>].done stamp file matching the fingerprint of current "
+                                 "inputs (pheno/covar content, genotype files, filter options and --config), or with "
+                                 "missing outputs; without this option all jobs are generated, but up-to-date tasks "
+                                 "are skipped when jobs are executed")
+
     subparsers = parser.add_subparsers(dest='cmd')
     subparsers.required = True
 
     parser_gwas_add_arguments(args=args, func=execute_gwas, parser=subparsers.add_parser(
-        "gwas", parents=[parent_parser, pheno_parser, filter_parser],
+        "gwas", parents=[parent_parser, pheno_parser, filter_parser, executor_parser],
         help='perform GWAS (genome-wide association) analysis'))
     parser_pgrs_add_arguments(args=args, func=execute_pgrs, parser=subparsers.add_parser(
-        "pgrs", parents=[parent_parser, pheno_parser], help='compute polygenic risk score'))
+        "pgrs", parents=[parent_parser, pheno_parser, executor_parser], help='compute polygenic risk score'))
+
+    parser_plan_add_arguments(args=args, func=execute_plan, parser=subparsers.add_parser(
+        "plan", parents=[parent_parser],
+        help='generate GWAS jobs for all combinations of cohorts and traits listed in a manifest file'))
 
     parser_merge_plink2_add_arguments(args=args, func=merge_plink2, parser=subparsers.add_parser(
         "merge-plink2", parents=[parent_parser, filter_parser], help='merge plink2 sumstats files'))
     parser_merge_regenie_add_arguments(args=args, func=merge_regenie, parser=subparsers.add_parser(
         "merge-regenie", parents=[parent_parser, filter_parser], help='merge regenie sumstats files'))
+    parser_figures_add_arguments(args=args, func=make_figures, parser=subparsers.add_parser(
+        "figures", parents=[parent_parser], help='make QQ and manhattan plots for merged sumstats file'))
 
     return parser.parse_args(args)
 
@@ -218,6 +265,51 @@ def parser_gwas_add_arguments(args, func, parser):
 
     parser.add_argument('--vcf-field', type=str, default='DS',
                         choices=['DS', 'GT'], help='field to read for vcf files')
+    parser.add_argument("--out-format", type=str, nargs='+', default=['gz'], choices=['gz', 'parquet', 'feather'],
+                        help="formats of the merged summary statistics, passed to merge-plink2 / merge-regenie; "
+                        "'--analysis figures' reads the first format, and requires 'gz' with '--figures-engine R'")
+    parser.add_argument("--shard-variants", type=int, default=None,
+                        help="target number of variants per SLURM array task; when specified, chromosomes of "
+                        "--geno-file are split into shards with roughly equal number of variants (according to .bim, "
+                        ".pvar or .bgen.bgi file), i.e. small chromosomes are packed together and large chromosomes "
+                        "are split by base-pair ranges; shards are saved to <out>.shards. Default is to run one array "
+                        "task per chromosome")
+    parser.add_argument("--figures-engine", type=str, default='R', choices=['R', 'python'],
+                        help="tool to make QQ and manhattan plots for '--analysis figures': 'R' uses qqman and "
+                        "GWASTools packages from r.sif container, 'python' uses 'gwas.py figures' which reads "
+                        "CHR, BP and P columns in a single streaming pass and bins non-significant variants")
+    parser.add_argument("--step1-cache", type=str, default=None,
+                        help="folder to cache regenie step1 predictions (.step1_pred.list and .loco files), keyed by "
+                        "a hash of <out>.pheno and <out>.covar content, --geno-fit-file, step1 filters and regenie "
+                        "step1 options from --config file; runs with a matching cache entry skip regenie step1")
+    parser.add_argument("--qc-cache", type=str, default=None,
+                        help="folder to cache per-chromosome .afreq, .hardy and .vmiss files from plink2 --freq "
+                        "--hardy --missing, keyed by a hash of --geno-file (all chromosomes), individuals kept in "
+                        "<out>.pheno, --extract/--exclude and plink2 options from --config file; chromosomes already "
+                        "in the cache are skipped, and merge-plink2 / merge-regenie read QC metrics from the cache")
+    parser.add_argument("--vcf-cache", type=str, default=None,
+                        help="folder to keep .vcf / .vcf.gz --geno-file converted to plink2 .pgen format, keyed by "
+                        "a hash of all chromosomes of --geno-file and --vcf-field; chromosomes missing in the cache "
+                        "are converted by a separate job, and all plink2 commands read the converted .pgen files")
+    parser.add_argument("--pheno-batch-mem", type=float, default=None,
+                        help="memory budget (in GB) per batch of phenotypes; when specified, --pheno is split into "
+                        "batches analyzed by separate jobs (<out>_b<k> prefix), with the number of phenotypes in a "
+                        "batch limited by the estimated memory of their values for all individuals. --pheno of "
+                        "BINARY and CONTINUOUS types are always split into separate batches")
+    parser.add_argument("--pheno-batch-overlap", type=float, default=None,
+                        help="minimum overlap (Jaccard index) of individuals with non-missing values, for phenotypes "
+                        "to be put into the same batch; e.g. 0.9 separates phenotypes with different missingness "
+                        "patterns, so that tools don't exclude or impute individuals across unrelated phenotypes")
+    parser.set_defaults(func=func)
+
+def parser_plan_add_arguments(args, func, parser):
+    parser.add_argument("--manifest", type=str, default=None,
+                        help="YAML file with 'cohorts' and 'traits' lists, and optional 'defaults' section; each "
+                        "entry has a 'name' and options of 'gwas.py gwas' (without leading '--', e.g. 'geno-file' "
+                        "for cohorts or 'pheno' for traits, with empty value for flags). For each cohort and trait, "
+                        "jobs are generated as by 'gwas.py gwas' with options from defaults, cohort and trait "
+                        "(in this order of precedence), and --out <out>/<cohort>/<trait>. --fam, --pheno-file and "
+                        "other inputs shared by several combinations are read once.")
     parser.set_defaults(func=func)
 
 def parser_merge_plink2_add_arguments(args, func, parser):
@@ -227,6 +319,27 @@ def parser_merge_plink2_add_arguments(args, func, parser):
                         help="basename for .vmiss, .afreq and .hardy files, with @ as chromosome label place holder")
     parser.add_argument("--chr2use", type=str, default='1-22',
                         help="Chromosome ids to use, (e.g. 1,2,3 or 1-4,12,16-20).")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="number of rows to read from --sumstats at a time; when specified, each chromosome is "
+                        "filtered and appended to the output in chunks, so that peak memory depends on chunk size "
+                        "rather than on the total number of variants. Default is to process a whole chromosome "
+                        "at once.")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="number of worker processes used to parse and filter chromosomes in parallel, and "
+                        "number of threads to compress the output; chromosomes are still written to the output in "
+                        "--chr2use order.")
+    parser.add_argument("--out-format", type=str, nargs='+', default=['gz'], choices=['gz', 'parquet', 'feather'],
+                        help="output formats: 'gz' is a tab-separated BGZF-compressed <out>.gz file with tabix index; "
+                        "'parquet' and 'feather' are columnar datasets (<out>.parquet, <out>.feather) partitioned by "
+                        "CHR, allowing to load selected columns and chromosomes; require pyarrow package.")
+    parser.add_argument("--shards", type=str, default=None,
+                        help="<out>.shards file produced by 'gwas.py gwas --shard-variants'; when specified, '@' in "
+                        "--sumstats and --basename is replaced by LABEL of each segment, and segments of each "
+                        "chromosome are merged in base-pair order")
+    parser.add_argument("--pheno", type=str, nargs='+', default=None,
+                        help="phenotypes to merge in a single process; when specified, '{pheno}' in --sumstats is "
+                        "replaced by each phenotype, output files are named <out>_<pheno>, and filter tables "
+                        "(.afreq, .hardy, .vmiss and --info-file) are read once for all phenotypes")
     parser.set_defaults(func=func)
 
 def parser_merge_regenie_add_arguments(args, func, parser):
@@ -236,6 +349,30 @@ def parser_merge_regenie_add_arguments(args, func, parser):
                         help="basename for .vmiss, .afreq and .hardy files, with @ as chromosome label place holder")
     parser.add_argument("--chr2use", type=str, default='1-22',
                         help="Chromosome ids to use, (e.g. 1,2,3 or 1-4,12,16-20).")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="number of rows to read from --sumstats at a time; see merge-plink2 --chunksize.")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="number of worker processes used to parse and filter chromosomes in parallel.")
+    parser.add_argument("--out-format", type=str, nargs='+', default=['gz'], choices=['gz', 'parquet', 'feather'],
+                        help="output formats; see merge-plink2 --out-format.")
+    parser.add_argument("--shards", type=str, default=None,
+                        help="<out>.shards file produced by 'gwas.py gwas --shard-variants'; when specified, '@' in "
+                        "--sumstats and --basename is replaced by LABEL of each segment, and segments of each "
+                        "chromosome are merged in base-pair order")
+    parser.add_argument("--pheno", type=str, nargs='+', default=None,
+                        help="phenotypes to merge in a single process; see merge-plink2 --pheno.")
+    parser.set_defaults(func=func)
+
+def parser_figures_add_arguments(args, func, parser):
+    parser.add_argument("--sumstats", type=str, default=None,
+                        help="merged sumstats file (<out>.gz, or <out>.parquet / <out>.feather dataset) with CHR, BP "
+                        "and P columns. Figures are saved to <out>.qq.png, <out>.qq.png.json and <out>.manh.png")
+    parser.add_argument("--title", type=str, default='', help="title of the figures")
+    parser.add_argument("--chunksize", type=int, default=1000000,
+                        help="number of rows to read from --sumstats at a time")
+    parser.add_argument("--tail-p", type=float, default=1e-3,
+                        help="variants with p-value below this threshold are plotted individually; the remaining "
+                        "variants are binned, which bounds the memory and the number of points to draw")
     parser.set_defaults(func=func)
 
 # extract 'variables' from 'df' and return a new dataframe with extracted variables
@@ -244,18 +381,52 @@ def parser_merge_regenie_add_arguments(args, func, parser):
 def extract_variables(df, variables, pheno_dict_map, log):
     cat_vars = [x for x in variables if pheno_dict_map[x] == 'NOMINAL']
     other_vars = ['FID', 'IID'] + [x for x in variables if pheno_dict_map[x] != 'NOMINAL']
-
-    dummies = df[other_vars]
+    if not cat_vars:
+        return df[other_vars].copy()
+    design_matrix, design_columns = make_design_matrix(df, cat_vars, log)
+    return pd.concat([df[other_vars], pd.DataFrame(design_matrix, columns=design_columns, index=df.index)], axis=1)
+
+# one-hot encode categorical variables into a single 0/1 matrix, from integer codes of sorted category levels;
+# the most frequent level of each variable is used as reference category, and has no column in the matrix;
+# missing values are encoded as zeros in all columns of a variable
+def make_design_matrix(df, cat_vars, log):
+    rows, cols, names = [], [], []
     for var in cat_vars:
-        new = pd.get_dummies(df[var], prefix=var)
-        dummies = dummies.join(new)
-
-        # drop most frequent variable for ref category
-        drop_col = df.groupby([var]).size().idxmax()
-        dummies.drop('{}_{}'.format(var, drop_col), axis=1, inplace=True)
-
-        log.log('Variable {} will be extracted as dummie, dropping {} label (most frequent)'.format(var, drop_col))
-    return dummies.copy()
+        codes, levels = pd.factorize(df[var], sort=True)
+        ref = np.bincount(codes[codes >= 0], minlength=len(levels)).argmax()
+        valid = (codes >= 0) & (codes != ref)
+        rows.append(np.flatnonzero(valid))
+        cols.append(codes[valid] - (codes[valid] > ref) + len(names))
+        names += ['{}_{}'.format(var, level) for index, level in enumerate(levels) if index != ref]
+        log.log('Variable {} will be extracted as dummie, dropping {} label (most frequent)'.format(var, levels[ref]))
+
+    design_matrix = np.zeros((len(df), len(names)), dtype=np.int8)
+    design_matrix[np.concatenate(rows), np.concatenate(cols)] = 1
+    return design_matrix, names
+
+# same as extract_variables(...).to_csv(fname, sep='\t', index=False), but dummie variables are written straight from
+# the design matrix as 0/1 characters, without converting them to a dataframe
+def write_variables(fname, df, variables, pheno_dict_map, log, chunksize=10000):
+    cat_vars = [x for x in variables if pheno_dict_map[x] == 'NOMINAL']
+    other_vars = ['FID', 'IID'] + [x for x in variables if pheno_dict_map[x] != 'NOMINAL']
+    design_matrix, design_columns = make_design_matrix(df, cat_vars, log) if cat_vars else \
+        (np.zeros((len(df), 0), dtype=np.int8), [])
+
+    log.log('writing {} columns (including FID, IID) for n={} individuals to {}'.format(
+        len(other_vars) + len(design_columns), len(df), fname))
+    width = 2 * len(design_columns) + 1
+    with open(fname, 'wb') as f:
+        f.write(('\t'.join(other_vars + design_columns) + '\n').encode())
+        for start in range(0, len(df), chunksize):
+            other_lines = df[other_vars].iloc[start:start + chunksize].to_csv(
+                sep='\t', header=False, index=False, lineterminator='\n').encode().split(b'\n')
+            block = design_matrix[start:start + chunksize]
+            chars = np.empty((len(block), width), dtype=np.uint8)
+            chars[:, 0:-1:2] = ord('\t')
+            chars[:, 1:-1:2] = block + ord('0')
+            chars[:, -1] = ord('\n')
+            chars = chars.tobytes()
+            f.write(b''.join(other_lines[i] + chars[i * width:(i + 1) * width] for i in range(len(block))))
 
 def is_bed_file(fname):
     return fname.endswith('.bed')
@@ -340,6 +511,10 @@ def fix_and_validate_gwas_args(args, log):
     if ('regenie' in args.analysis) and (not args.geno_fit_file):
         raise ValueError('--geno-fit-file must be specified for --analysis regenie')
 
+    if ('figures' in args.analysis) and (args.figures_engine == 'R') and ('gz' not in args.out_format):
+        raise ValueError("--analysis figures with --figures-engine R requires 'gz' in --out-format; "
+                         "use --figures-engine python to make figures from parquet or feather files")
+
 def get_args_from_config(conf_obj, *args):
     def unpack(d, li):
         return unpack(d[li[0]], li[1:]) if len(li) != 0 else d
@@ -348,9 +523,10 @@ def get_args_from_config(conf_obj, *args):
     except (KeyError, AttributeError):
         return ""
 
-def make_regenie_commands(args, logistic, step):
+# step1_prefix - --out of regenie step1, defaults to <out>.step1
+def make_regenie_commands(args, logistic, step, step1_prefix=None):
     geno_fit_file = args.geno_fit_file
-    geno_file = args.geno_file.replace('@', '${SLURM_ARRAY_TASK_ID}')
+    geno_file = args.geno_file.replace('@', chr_var(args))
     sample = replace_suffix(geno_file, ".bgen", ".sample")
     if (args.extract and args.extract_step2) or (args.extract and args.extract_step1):
         raise ValueError("--extract is not allowed with --extract-step1 or --extract-step2")
@@ -377,7 +553,7 @@ def make_regenie_commands(args, logistic, step):
     is_pgen = is_pgen_file(geno_fit_file)
     is_bgen = is_bgen_file(geno_fit_file)
     cmd_step1 = ' --step 1 --bsize 1000' + \
-        " --out {}.step1".format(args.out) + \
+        " --out {}".format(step1_prefix or (args.out + '.step1')) + \
         (" --bed {} --ref-first".format(remove_suffix(geno_fit_file, '.bed')) if is_bed else "") + \
         (" --pgen {} --ref-first".format(remove_suffix(geno_fit_file, '.pgen')) if is_pgen else "") + \
         (" --bgen {} --ref-first".format(geno_fit_file) if is_bgen else "") + \
@@ -391,19 +567,35 @@ def make_regenie_commands(args, logistic, step):
     is_pgen = is_pgen_file(geno_file)
     is_bgen = is_bgen_file(geno_file)
     cmd_step2 = ' --step 2 --bsize 400' + \
-        " --out {}_chr${{SLURM_ARRAY_TASK_ID}}".format(args.out) + \
+        " --out {}_chr{}".format(args.out, label_var(args)) + \
         (" --bed {} --ref-first".format(remove_suffix(geno_file, '.bed')) if is_bed else "") + \
         (" --pgen {} --ref-first".format(remove_suffix(geno_file, '.pgen')) if is_pgen else "") + \
         (" --bgen {} --ref-first --sample {}".format(geno_file, sample) if is_bgen else "") + \
         (" --bt --firth 0.01 --approx" if logistic else "") + \
         " --pred {}.step1_pred.list".format(args.out) + \
-        " --chr ${SLURM_ARRAY_TASK_ID}" + \
+        (" --range ${CHR}:${FROM_BP}-${TO_BP}" if args.shard_variants else " --chr ${SLURM_ARRAY_TASK_ID}") + \
         (f" --exclude {args.exclude or args.exclude_step2}" if args.exclude or args.exclude_step2 else "") + \
         (f" --extract {args.extract or args.extract_step2}" if args.extract or args.extract_step2 else "") + \
         get_args_from_config(args.config_object, 'regenie', 'step2')
 
     return (cmd + cmd_step1) if step == 1 else (cmd + cmd_step2)
 
+
+# --step1-cache entry for regenie step1 of the current analysis: the key covers step1 command (with <out> as
+# a placeholder, as output names don't affect the predictions) and signatures of the files it reads
+STEP1_CACHE_VERSION = 1
+
+
+def regenie_step1_cache_dir(args, logistic):
+    placeholder_args = argparse.Namespace(**dict(vars(args), out='<out>'))
+    key = [STEP1_CACHE_VERSION, make_regenie_commands(placeholder_args, logistic, step=1)]
+    for fname in [args.out + '.pheno', args.out + '.covar' if args.covar else None, args.geno_fit_file,
+                  args.extract or args.extract_step1, args.exclude or args.exclude_step1]:
+        if fname:
+            key.append(file_signature(fname, args.chr2use))
+    return os.path.join(os.path.abspath(args.step1_cache),
+                        hashlib.sha256(json.dumps(key).encode()).hexdigest())
+
 # this function works similarly to ** in python:
 # all args from args_list that are not None are passed to the caller
 # see make_regenie_merge and make_plink2_merge for a usage example.
@@ -413,8 +605,19 @@ def pass_arguments_along(args, args_list):
     args = [(' --{} {} '.format(arg, '' if (val is True) else val) if val else '') for arg, val in zip(args_list, vals)]
     return ''.join(args)
 
+# merged summary statistics of a phenotype, one per --out-format: a .gz file, or a .parquet / .feather dataset directory
+def merged_sumstats_files(args, pheno):
+    return ['{}_{}.{}'.format(args.out, pheno, out_format) for out_format in args.out_format]
+
 def make_figures_commands(args):
     cmd = ''
+    if args.figures_engine == 'python':
+        for pheno in args.pheno:
+            sumstats = merged_sumstats_files(args, pheno)[0]
+            cmd += '$PYTHON gwas.py figures --sumstats {sumstats} --title {pheno} --out {out}_{pheno} ' \
+                '--log {out}_{pheno}.figures.log\n'.format(sumstats=sumstats, out=args.out, pheno=pheno)
+        return cmd
+
     for pheno in args.pheno:
         Rcmd = 'library(data.table);library(qqman);library(ggplot2);'
         Rcmd += 'library(GWASTools);'
@@ -429,37 +632,55 @@ def make_figures_commands(args):
         cmd += "$RSCRIPT -e '{}'\n".format(Rcmd)
     return cmd
 
+# all phenotypes are merged by a single process, which reads filter tables once;
+# it logs to <out>.merge.log, as <out>.log is the log of 'gwas.py gwas'
 def make_regenie_merge_commands(args, logistic):
-    cmd = ''
-    for pheno in args.pheno:
-        cmd += '$PYTHON gwas.py merge-regenie ' + \
-            pass_arguments_along(args, ['info-file', 'info', 'maf', 'hwe', 'geno']) + \
-            ' --sumstats {out}_chr@_{pheno}.regenie'.format(out=args.out, pheno=pheno) + \
-            ' --basename {out}_chr@'.format(out=args.out) + \
-            ' --out {out}_{pheno} '.format(out=args.out, pheno=pheno) + \
-            ' --chr2use {} '.format(','.join(args.chr2use)) + \
-            '\n'
-    return cmd
-
+    return '$PYTHON gwas.py merge-regenie ' + \
+        pass_arguments_along(args, ['info-file', 'info', 'maf', 'hwe', 'geno']) + \
+        ' --sumstats {out}_chr@_{{pheno}}.regenie'.format(out=args.out) + \
+        ' --basename {}'.format(qc_basename(args)) + \
+        ' --pheno {} '.format(' '.join(args.pheno)) + \
+        ' --out {out} --log {out}.merge.log '.format(out=args.out) + \
+        ' --chr2use {} '.format(','.join(args.chr2use)) + \
+        (' --shards {}.shards '.format(args.out) if args.shard_variants else '') + \
+        ' --threads {} '.format(args.config_object['slurm']['cpus_per_task']) + \
+        ' --out-format {} '.format(' '.join(args.out_format)) + \
+        '\n'
+
+# plink2 writes .glm.logistic.hybrid or .glm.firth files instead of .glm.logistic, which merge-plink2 accepts as is
 def make_plink2_merge_commands(args, logistic):
-    cmd = ''
-    # Move *.glm.logistic.hybrid and *.glm.firth to *.glm.logistic
-    cmd += """find . -type f -name "*.glm.logistic.hybrid" -exec sh -c 'mv "$1" "${1%.glm.logistic.hybrid}.glm"""
-    cmd += """.logistic"' _ {} \\;\n"""
-    cmd += """find . -type f -name "*.glm.firth" -exec sh -c 'mv "$1" "${1%.glm.firth}.glm.logistic"' _ {} \\;\n"""
-    for pheno in args.pheno:
-        cmd += '$PYTHON gwas.py merge-plink2 ' + \
-            pass_arguments_along(args, ['info-file', 'info', 'maf', 'hwe', 'geno']) + \
-            ' --sumstats {out}_chr@.{pheno}.glm.{what}'.format(
-                out=args.out, pheno=pheno, what=('logistic' if logistic else 'linear')) + \
-            ' --basename {out}_chr@'.format(out=args.out) + \
-            ' --out {out}_{pheno} '.format(out=args.out, pheno=pheno) + \
-            ' --chr2use {} '.format(','.join(args.chr2use)) + \
-            '\n'
-    return cmd
+    return '$PYTHON gwas.py merge-plink2 ' + \
+        pass_arguments_along(args, ['info-file', 'info', 'maf', 'hwe', 'geno']) + \
+        ' --sumstats {out}_chr@.{{pheno}}.glm.{what}'.format(
+            out=args.out, what=('logistic' if logistic else 'linear')) + \
+        ' --basename {}'.format(qc_basename(args)) + \
+        ' --pheno {} '.format(' '.join(args.pheno)) + \
+        ' --out {out} --log {out}.merge.log '.format(out=args.out) + \
+        ' --chr2use {} '.format(','.join(args.chr2use)) + \
+        (' --shards {}.shards '.format(args.out) if args.shard_variants else '') + \
+        ' --threads {} '.format(args.config_object['slurm']['cpus_per_task']) + \
+        ' --out-format {} '.format(' '.join(args.out_format)) + \
+        '\n'
+
+# shell variables to use in per-chromosome commands: with --shard-variants each SLURM array task loops over segments
+# of its shard, setting CHR, FROM_BP, TO_BP and LABEL variables (see make_shard_loop); otherwise SLURM_ARRAY_TASK_ID
+# is the chromosome label
+def chr_var(args):
+    return '${CHR}' if args.shard_variants else '${SLURM_ARRAY_TASK_ID}'
+
+def label_var(args):
+    return '${LABEL}' if args.shard_variants else '${SLURM_ARRAY_TASK_ID}'
+
+def make_shard_loop(args, command):
+    if not args.shard_variants:
+        return command
+    return ("for SEGMENT in $(awk -v shard=${{SLURM_ARRAY_TASK_ID}} 'NR>1 && $1==shard "
+            "{{print $2\":\"$3\":\"$4\":\"$5}}' {out}.shards); do "
+            "IFS=: read CHR FROM_BP TO_BP LABEL <<< \"$SEGMENT\"; {command}; done").format(
+                out=args.out, command=command)
 
 def make_plink2_commands(args):
-    geno_file = args.geno_file.replace('@', '${SLURM_ARRAY_TASK_ID}')
+    geno_file = args.geno_file.replace('@', chr_var(args))
     if (args.extract and args.exclude):
         raise ValueError("--exclude is not allowed with --extract")
     cmd = "$PLINK2 " + \
@@ -467,27 +688,84 @@ def make_plink2_commands(args):
         (" --pfile {} --no-pheno".format(remove_suffix(geno_file, '.pgen')) if is_pgen_file(geno_file) else "") + \
         (" --bgen {} ref-first --sample {}".format(
             geno_file, replace_suffix(geno_file, ".bgen", ".sample")) if is_bgen_file(geno_file) else "") + \
-        (" --vcf {} --double-id".format(geno_file) if is_vcf_file(geno_file) else "") + \
-        " --chr ${SLURM_ARRAY_TASK_ID}" + \
+        (make_vcf_import_args(args, geno_file) if is_vcf_file(geno_file) else "") + \
+        " --chr {}".format(chr_var(args)) + \
+        (" --from-bp ${FROM_BP} --to-bp ${TO_BP}" if args.shard_variants else "") + \
         (f" --exclude {args.exclude}" if args.exclude else "") + \
         (f" --extract {args.extract}" if args.extract else "") + \
         get_args_from_config(args.config_object, 'plink2')
     return cmd
 
+def make_vcf_import_args(args, vcf_file):
+    return " --vcf {}{} --double-id".format(vcf_file, ' dosage=DS' if (args.vcf_field == 'DS') else '')
+
+# convert .vcf --geno-file to .pgen; outputs are renamed once complete, as they are shared via --vcf-cache
+def make_vcf_to_pgen_commands(args, vcf_file, pgen_file):
+    prefix = remove_suffix(pgen_file, '.pgen').replace('@', '${SLURM_ARRAY_TASK_ID}')
+    return ("$PLINK2 {} --make-pgen --out {prefix}.tmp; "
+            "for suffix in pgen pvar psam log; do mv {prefix}.tmp.$suffix {prefix}.$suffix; done").format(
+                make_vcf_import_args(args, vcf_file.replace('@', '${SLURM_ARRAY_TASK_ID}')), prefix=prefix)
+
+
+# --vcf-cache entry for --geno-file: the key covers plink2 --vcf arguments and signatures of all chromosomes of
+# --geno-file (regardless of --chr2use); the entry has chr<label>.pgen files, or all.pgen if --geno-file has no '@'
+VCF_CACHE_VERSION = 1
+
+
+def vcf_cache_dir(args):
+    key = [VCF_CACHE_VERSION, make_vcf_import_args(args, '<vcf>')]
+    geno_files = sorted(glob.glob(args.geno_file.replace('@', '*'))) if ('@' in args.geno_file) else [args.geno_file]
+    for fname in geno_files:
+        key.append(file_signature(fname, args.chr2use))
+    return os.path.join(os.path.abspath(args.vcf_cache), hashlib.sha256(json.dumps(key).encode()).hexdigest())
+
 def make_plink2_glm_commands(args, logistic):
     cmd = make_plink2_commands(args) + \
         " --glm cols=+a1freq{} hide-covar --ci 0.95".format(",+totallelecc" if (logistic) else "") + \
         " --pheno {}.pheno".format(args.out) + \
         (" --covar {}.covar".format(args.out) if args.covar else "") + \
-        " --out {}_chr${{SLURM_ARRAY_TASK_ID}}".format(args.out)
+        " --out {}_chr{}".format(args.out, label_var(args))
     return cmd
 
 def make_plink2_info_commands(args):
+    basename = qc_basename(args).replace('@', label_var(args))
     cmd = make_plink2_commands(args) + \
         " --missing --freq --hardy " + \
-        " --keep {}.pheno".format(args.out) + \
-        " --out {}_chr${{SLURM_ARRAY_TASK_ID}}".format(args.out)
-    return cmd
+        " --keep {}.pheno".format(args.out)
+    # on chrX plink2 writes .hardy.x instead of .hardy; it has the same ID and P columns, and is renamed to .hardy
+    if not args.qc_cache:
+        return cmd + " --out {basename}; if [ -f {basename}.hardy.x ]; then mv {basename}.hardy.x {basename}.hardy; " \
+            "fi".format(basename=basename)
+    # with --qc-cache, segments already in the cache are skipped; outputs are written to a unique temporary folder
+    # and moved to the cache once complete (.afreq last), so that concurrent runs sharing the cache don't overwrite
+    # each other's partial outputs
+    return ("if [ ! -f {basename}.afreq ] || [ ! -f {basename}.hardy ] || [ ! -f {basename}.vmiss ]; then "
+            "tmp_dir=$(mktemp -d {cache_dir}/tmp.XXXXXX); {cmd} --out $tmp_dir/qc; "
+            "if [ -f $tmp_dir/qc.hardy.x ]; then mv $tmp_dir/qc.hardy.x $tmp_dir/qc.hardy; fi; "
+            "for suffix in log smiss vmiss hardy afreq; do mv $tmp_dir/qc.$suffix {basename}.$suffix; done; "
+            "rm -rf $tmp_dir; fi").format(basename=basename, cache_dir=args.qc_cache_dir, cmd=cmd)
+
+# basename of .afreq, .hardy and .vmiss files, with '@' as a placeholder for chromosome (or segment) label
+def qc_basename(args):
+    return os.path.join(args.qc_cache_dir, 'chr@') if args.qc_cache else (args.out + '_chr@')
+
+
+# --qc-cache entry for the current analysis: the key covers plink2 command (without output and sample names),
+# signatures of all chromosomes of --geno-file and filter files, and FID/IID pairs of individuals in <out>.pheno;
+# it doesn't depend on --chr2use, so that runs on different chromosomes share the entry
+QC_CACHE_VERSION = 1
+
+
+def plink2_info_cache_dir(args):
+    placeholder_args = argparse.Namespace(**dict(vars(args), out='<out>'))
+    samples = pd.read_csv(args.out + '.pheno', sep='\t', usecols=['FID', 'IID'], dtype=str)
+    samples = sorted(set(zip(samples['FID'], samples['IID'])))
+    key = [QC_CACHE_VERSION, make_plink2_commands(placeholder_args), args.shard_variants,
+           hashlib.sha256('\n'.join(' '.join(sample) for sample in samples).encode()).hexdigest()]
+    geno_files = sorted(glob.glob(args.geno_file.replace('@', '*'))) if ('@' in args.geno_file) else [args.geno_file]
+    for fname in geno_files + [fname for fname in [args.extract, args.exclude] if fname]:
+        key.append(file_signature(fname, args.chr2use))
+    return os.path.join(os.path.abspath(args.qc_cache), hashlib.sha256(json.dumps(key).encode()).hexdigest())
 
 def make_prsice2_commands(args, logistic):
     geno_file = args.geno_file.replace('@', '${SLURM_ARRAY_TASK_ID}')
@@ -508,6 +786,18 @@ def make_prsice2_commands(args, logistic):
 
     return cmd
 
+# environment variables defining tools used by the generated commands, as (name, value) pairs
+def make_tool_exports(args):
+    return [('COMORMENT', args.config_object['comorment_folder']),
+            ('SINGULARITY_BIND', '"{}"'.format(args.config_object['singularity_bind'])),
+            ('SIF', '$COMORMENT/containers/singularity'),
+            None,
+            ('PLINK2', '"singularity exec --home $PWD:/home $SIF/gwas.sif plink2"'),
+            ('REGENIE', '"singularity exec --home $PWD:/home $SIF/gwas.sif regenie"'),
+            ('PYTHON', '"singularity exec --home $PWD:/home $SIF/python3.sif python"'),
+            ('RSCRIPT', '"singularity exec --home $PWD:/home $SIF/r.sif Rscript"'),
+            ('PRSICE2', '"singularity exec --home $PWD:/home $SIF/gwas.sif PRSice_linux"')]
+
 def make_slurm_header(args, array_spec=None):
     return """#!/bin/bash
 #SBATCH --job-name={job_name}
@@ -519,15 +809,7 @@ def make_slurm_header(args, array_spec=None):
 
 {modules}
 
-export COMORMENT={comorment_folder}
-export SINGULARITY_BIND="{singularity_bind}"
-export SIF=$COMORMENT/containers/singularity
-
-export PLINK2="singularity exec --home $PWD:/home $SIF/gwas.sif plink2"
-export REGENIE="singularity exec --home $PWD:/home $SIF/gwas.sif regenie"
-export PYTHON="singularity exec --home $PWD:/home $SIF/python3.sif python"
-export RSCRIPT="singularity exec --home $PWD:/home $SIF/r.sif Rscript"
-export PRSICE2="singularity exec --home $PWD:/home $SIF/gwas.sif PRSice_linux"
+{exports}
 
 """.format(array="#SBATCH --array={}".format(','.join(array_spec)) if (array_spec is not None) else "",
            modules='\n'.join(['module load {}'.format(x) for x in args.config_object['slurm']['module_load']]),
@@ -536,26 +818,43 @@ export PRSICE2="singularity exec --home $PWD:/home $SIF/gwas.sif PRSice_linux"
            time=args.config_object['slurm']['time'],
            cpus_per_task=args.config_object['slurm']['cpus_per_task'],
            mem_per_cpu=args.config_object['slurm']['mem_per_cpu'],
-           comorment_folder=args.config_object['comorment_folder'],
-           singularity_bind=args.config_object['singularity_bind'])
+           exports='\n'.join([('export {}={}'.format(*x) if x else '') for x in make_tool_exports(args)]))
+
+# same as make_slurm_header, but for '--executor local': variables already defined in the environment take
+# precedence, e.g. to use apptainer instead of singularity, or a different location of the containers
+def make_local_header(args):
+    return '\n'.join([('export {0}=${{{0}:-{1}}}'.format(*x) if x else '') for x in make_tool_exports(args)]) + '\n'
+
+# convert SLURM memory specification (e.g. 8000M or 8G) to megabytes
+def parse_slurm_mem(value):
+    value = str(value).strip().upper()
+    scale = {'K': 1.0 / 1024, 'M': 1, 'G': 1024, 'T': 1024 ** 2}
+    if value[-1] in scale:
+        return float(value[:-1]) * scale[value[-1]]
+    return float(value)
 
 def prepare_covar_and_phenofiles(args, log, cc12):
-    fam = read_fam(args, args.fam)
-    pheno, pheno_dict = read_comorment_pheno(args, args.pheno_file, args.dict_file)
+    fam, pheno, pheno_dict_map = read_covar_and_pheno(args, log)
+    return write_covar_and_phenofiles(args, log, cc12, fam, pheno, pheno_dict_map)
+
+# read --pheno-file, merge it with --fam and apply --covar and --variance-standardize to individuals and values;
+# returns all individuals, with --pheno columns of any BINARY or CONTINUOUS type
+def read_covar_and_pheno(args, log):
+    fam = read_shared_input(args, ('fam', args.fam), lambda: read_fam(args, args.fam))
+    columns = args.pheno + args.covar + (args.variance_standardize if args.variance_standardize else [])
+    pheno, pheno_dict = read_shared_input(
+        args, ('pheno', args.pheno_file, args.dict_file, args.pheno_sep, args.dict_sep),
+        lambda: read_comorment_pheno(args, args.pheno_file, args.dict_file, vars(args).get('plan_columns', columns)))
+    pheno = apply_keep_and_remove(args, pheno[[c for c in pheno.columns if (c in ['IID', 'FID'] + columns)]])
     pheno_dict_map = dict(zip(pheno_dict['FIELD'], pheno_dict['TYPE']))
 
     missing_cols = [str(c) for c in args.pheno if (c not in pheno.columns)]
     if missing_cols:
         raise ValueError('--pheno not present in --pheno-file: {}'.format(', '.join(missing_cols)))
 
-    pheno_types = [pheno_dict_map[pheno] for pheno in args.pheno]
-    for pheno_type in pheno_types:
+    for pheno_type in [pheno_dict_map[pheno] for pheno in args.pheno]:
         if pheno_type not in ['BINARY', 'CONTINUOUS']:
             raise ValueError('only BINARY or CONTINOUS varibales can be used as --pheno')
-    pheno_type = list(set(pheno_types))
-    if len(pheno_type) != 1:
-        raise ValueError('--pheno variables has a mix of BINARY and CONTINUOS types')
-    pheno_type = pheno_type[0]
 
     if 'FID' in pheno.columns:
         log.log("FID column is present in --pheno-file; FID column will be taken from --fam file")
@@ -605,12 +904,18 @@ def prepare_covar_and_phenofiles(args, log, cc12):
             log.log('phenotype {} had mean {:.5f} and std {:.5f}, and will be standardized'.format(col, mean, std))
             pheno[col] = (pheno[col].values - mean) / std
 
+    return fam, pheno, pheno_dict_map
+
+# write <out>.covar, <out>.pheno (with --pheno columns) and <out>.sample files, returns type of --pheno variables
+def write_covar_and_phenofiles(args, log, cc12, fam, pheno, pheno_dict_map):
+    pheno_type = list(set([pheno_dict_map[pheno] for pheno in args.pheno]))
+    if len(pheno_type) != 1:
+        raise ValueError('--pheno variables has a mix of BINARY and CONTINUOS types')
+    pheno_type = pheno_type[0]
+
     log.log("extracting covariates...")
     if args.covar:
-        covar_output = extract_variables(pheno, args.covar, pheno_dict_map, log)
-        log.log('writing {} columns (including FID, IID) for n={} individuals to {}.covar'.format(
-            covar_output.shape[1], len(covar_output), args.out))
-        covar_output.to_csv(args.out + '.covar', index=False, sep='\t')
+        write_variables(args.out + '.covar', pheno, args.covar, pheno_dict_map, log)
     else:
         log.log('--covar not specified')
 
@@ -641,6 +946,103 @@ def prepare_covar_and_phenofiles(args, log, cc12):
     log.log('all --pheno variables have type: {}'.format(pheno_type))
     return pheno_type
 
+
+# approximate memory per value of a phenotype in regenie step1 (phenotype and residuals, and level 0 predictions
+# for 5 ridge parameters, all in double precision)
+PHENO_BATCH_BYTES_PER_VALUE = 8 * 7
+
+
+# split --pheno into batches of phenotypes with the same type, similar missingness (--pheno-batch-overlap) and
+# limited memory (--pheno-batch-mem); phenotypes are assigned in the order of --pheno, to the first batch that
+# accepts them, comparing non-missing individuals to those of the first phenotype in the batch.
+# Returns a list of (suffix of --out, list of phenotypes); suffix is empty if there is only one batch.
+def plan_pheno_batches(args, log, pheno, pheno_dict_map):
+    max_size = len(args.pheno)
+    if args.pheno_batch_mem:
+        max_size = max(1, int(args.pheno_batch_mem * 1024 ** 3 // (len(pheno) * PHENO_BATCH_BYTES_PER_VALUE)))
+
+    batches = []
+    for name in args.pheno:
+        pheno_type, mask = pheno_dict_map[name], pheno[name].notnull().values
+        for batch in batches:
+            if (batch['type'] != pheno_type) or (len(batch['pheno']) >= max_size):
+                continue
+            if args.pheno_batch_overlap is not None:
+                union = np.sum(batch['mask'] | mask)
+                if union and (np.sum(batch['mask'] & mask) / union < args.pheno_batch_overlap):
+                    continue
+            batch['pheno'].append(name)
+            break
+        else:
+            batches.append({'type': pheno_type, 'mask': mask, 'pheno': [name]})
+
+    if len(batches) == 1:
+        return [('', args.pheno)]
+    log.log('--pheno is split into {} batches, up to {} phenotypes per batch'.format(len(batches), max_size))
+    for index, batch in enumerate(batches, start=1):
+        log.log('batch {}_b{}: {} {} phenotype(s), n={} individuals with non-missing {}'.format(
+            args.out, index, len(batch['pheno']), batch['type'], np.sum(batch['mask']), batch['pheno'][0]))
+    return [('_b{}'.format(index), batch['pheno']) for index, batch in enumerate(batches, start=1)]
+
+# read chromosome and base-pair position of variants in --geno-file, from .bim, .pvar or .bgen.bgi file
+def read_variant_positions(args, log):
+    positions = []
+    for chri in (args.chr2use if ('@' in args.geno_file) else ['@']):
+        geno_file = args.geno_file.replace('@', chri)
+        if is_bed_file(geno_file):
+            fname = replace_suffix(geno_file, '.bed', '.bim')
+        elif is_pgen_file(geno_file):
+            fname = replace_suffix(geno_file, '.pgen', '.pvar')
+        elif is_bgen_file(geno_file):
+            fname = geno_file + '.bgi'
+        else:
+            raise ValueError('--shard-variants requires .bed, .pgen or .bgen --geno-file')
+        check_input_file(fname)
+        log.log('reading {}...'.format(fname))
+        if is_bgen_file(geno_file):
+            import sqlite3
+            with sqlite3.connect(fname) as connection:
+                df = pd.read_sql_query('SELECT chromosome AS CHR, position AS BP FROM Variant', connection)
+        elif is_pgen_file(geno_file) and (read_pvar_header(fname) is not None):
+            df = pd.read_csv(fname, sep='\t', skiprows=read_pvar_header(fname), usecols=['#CHROM', 'POS'],
+                             dtype={'#CHROM': str}).rename(columns={'#CHROM': 'CHR', 'POS': 'BP'})
+        else:
+            df = pd.read_csv(fname, delim_whitespace=True, header=None, usecols=[0, 3], names=['CHR', 'BP'],
+                             dtype={'CHR': str})
+        log.log('done, {} variants'.format(len(df)))
+        positions.append(df[['CHR', 'BP']].astype({'CHR': str}))
+    return pd.concat(positions)
+
+# number of '##' lines to skip before the '#CHROM' header line of a .pvar file, or None if .pvar has no header
+def read_pvar_header(fname):
+    with open(fname) as f:
+        for index, line in enumerate(f):
+            if not line.startswith('##'):
+                return index if line.startswith('#CHROM') else None
+    return None
+
+# split chromosomes into segments of at most shard_variants variants (cutting only between distinct positions),
+# and pack consecutive segments into shards of at most shard_variants variants; each segment gets a LABEL that
+# replaces '@' in file names (chromosome label, or <chr>.<part> for chromosomes split into several segments)
+def make_shards(positions, chr2use, shard_variants):
+    rows, shard, shard_size = [], 1, 0
+    for chri in chr2use:
+        bp = np.sort(positions.loc[positions['CHR'] == chri, 'BP'].values)
+        if len(bp) == 0:
+            continue
+        num_parts = int(np.ceil(len(bp) / shard_variants))
+        cuts = np.searchsorted(bp, bp[(np.arange(1, num_parts) * len(bp)) // num_parts], side='left')
+        bounds = np.unique(np.concatenate([[0], cuts[cuts > 0], [len(bp)]]))
+        for part, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]), start=1):
+            if (shard_size > 0) and (shard_size + (end - start) > shard_variants):
+                shard, shard_size = shard + 1, 0
+            label = chri if (len(bounds) == 2) else '{}.{}'.format(chri, part)
+            rows.append((shard, chri, bp[start], bp[end - 1], label, end - start))
+            shard_size += end - start
+    if not rows:
+        raise ValueError('no variants found in --geno-file for --chr2use chromosomes')
+    return pd.DataFrame(rows, columns=['SHARD', 'CHR', 'FROM_BP', 'TO_BP', 'LABEL', 'NVARIANTS'])
+
 def execute_pgrs(args, log):
     fix_and_validate_chr2use(args, log)
     fix_and_validate_pheno_args(args, log)
@@ -658,19 +1060,21 @@ def execute_pgrs(args, log):
     pheno_type = prepare_covar_and_phenofiles(args, log, cc12=True)
     logistic = (pheno_type == 'BINARY')
 
-    cmd_file = args.out + '_cmd.sh'
-    if os.path.exists(cmd_file):
-        os.remove(cmd_file)
-    submit_jobs = []
-
-    num_jobs = 0
-
+    jobs = JobGraph(args)
     if 'prsice2' in args.analysis:
-        commands = [make_prsice2_commands(args, logistic)]
-        num_jobs = append_job(args, commands, args.chr2use, num_jobs + 1, cmd_file, submit_jobs)
-
-    log.log("To submit all jobs via SLURM, use the following scripts, "
-            "otherwise execute commands from {}".format(cmd_file))
+        jobs.add('prsice2', [make_prsice2_commands(args, logistic)], args.chr2use,
+                 inputs=[args.geno_file, args.geno_ld_file, args.out + '.pheno', args.out + '.covar'],
+                 outputs=[args.out + '.summary'])
+
+    if args.resume:
+        jobs.resume(log)
+    cmd_file, submit_file = args.out + '_cmd.sh', args.out + '_submit.sh'
+    submit_jobs = jobs.write(cmd_file, submit_file)
+    if args.executor == 'local':
+        jobs.run_local(log)
+        return
+    log.log("To submit all jobs via SLURM, use the following scripts (also saved to {}), "
+            "otherwise execute commands from {}".format(submit_file, cmd_file))
     print('\n'.join(submit_jobs))
 
 def execute_gwas(args, log):
@@ -679,113 +1083,630 @@ def execute_gwas(args, log):
     fix_and_validate_gwas_args(args, log)
 
     cc12 = ('plink2' in args.analysis)  # for plink, case=2, control=1; other tools use case=1, control=0
-    pheno_type = prepare_covar_and_phenofiles(args, log, cc12)
-    logistic = (pheno_type == 'BINARY')
-    log.log('selected analysis: {}'.format('logistic' if logistic else 'linear'))
-
-    cmd_file = args.out + '_cmd.sh'
-    if os.path.exists(cmd_file):
-        os.remove(cmd_file)
-    submit_jobs = []
+    fam, pheno, pheno_dict_map = read_covar_and_pheno(args, log)
+    batches = plan_pheno_batches(args, log, pheno, pheno_dict_map)
+
+    vcf_file, vcf_array_spec = None, None
+    if args.vcf_cache and is_vcf_file(args.geno_file):
+        cache_dir = vcf_cache_dir(args)
+        os.makedirs(cache_dir, exist_ok=True)
+        vcf_file = args.geno_file
+        args.geno_file = os.path.join(cache_dir, 'chr@.pgen' if ('@' in vcf_file) else 'all.pgen')
+        vcf_chr2use = args.chr2use if ('@' in vcf_file) else ['@']
+        vcf_array_spec = [chri for chri in vcf_chr2use if not all(
+            os.path.exists(replace_suffix(args.geno_file.replace('@', chri), '.pgen', suffix))
+            for suffix in ['.pgen', '.pvar', '.psam'])]
+        log.log('{} of {} .vcf files are already converted to .pgen in {}'.format(
+            len(vcf_chr2use) - len(vcf_array_spec), len(vcf_chr2use), cache_dir))
+        if vcf_array_spec and args.shard_variants:
+            raise ValueError('--shard-variants requires .pvar files, which are not yet available in --vcf-cache; '
+                             'please run without --shard-variants to convert .vcf files first')
+
+    shards, array_spec = None, args.chr2use
+    task_labels = {chri: [chri] for chri in args.chr2use}
+    if args.shard_variants:
+        positions = read_shared_input(args, ('positions', args.geno_file, tuple(args.chr2use)),
+                                      lambda: read_variant_positions(args, log))
+        shards = make_shards(positions, args.chr2use, args.shard_variants)
+        array_spec = [str(shard) for shard in shards['SHARD'].unique()]
+        task_labels = {str(shard): list(df['LABEL']) for shard, df in shards.groupby('SHARD')}
+        log.log('{} segments of {} chromosomes are grouped into {} shards'.format(
+            len(shards), len(shards['CHR'].unique()), len(array_spec)))
+
+    jobs = JobGraph(args)
+    if vcf_array_spec:
+        jobs.add('vcf_to_pgen', [make_vcf_to_pgen_commands(args, vcf_file, args.geno_file)],
+                 vcf_array_spec if ('@' in vcf_file) else None, inputs=[vcf_file], outputs=[args.geno_file])
+
+    # each batch of phenotypes has its own <out>.pheno, <out>.covar and <out>.shards files, and chain of jobs
+    for suffix, batch_pheno in batches:
+        batch_args = argparse.Namespace(**dict(vars(args), out=args.out + suffix, pheno=batch_pheno))
+        pheno_type = write_covar_and_phenofiles(batch_args, log, cc12, fam, pheno, pheno_dict_map)
+        logistic = (pheno_type == 'BINARY')
+        log.log('selected analysis: {}'.format('logistic' if logistic else 'linear'))
+        if shards is not None:
+            shards.to_csv(batch_args.out + '.shards', sep='\t', index=False)
+            log.log('shards are saved to {}.shards'.format(batch_args.out))
+        add_gwas_jobs(batch_args, log, jobs, logistic, array_spec, task_labels, suffix)
+
+    if args.resume:
+        jobs.resume(log)
+    cmd_file, submit_file = args.out + '_cmd.sh', args.out + '_submit.sh'
+    submit_jobs = jobs.write(cmd_file, submit_file)
+    if args.executor == 'local':
+        jobs.run_local(log)
+        return
+    log.log("To submit all jobs via SLURM, use the following scripts (also saved to {}), "
+            "otherwise execute commands from {}".format(submit_file, cmd_file))
+    print('\n'.join(submit_jobs))
 
-    num_jobs = 0
+# 'gwas.py plan' runs share args.shared_inputs dict (see execute_plan), so that an input parsed by one run
+# (--fam, --pheno-file, variant positions) is reused by the others; otherwise, read it
+def read_shared_input(args, key, read):
+    shared_inputs = vars(args).get('shared_inputs')
+    if shared_inputs is None:
+        return read()
+    if key in shared_inputs:
+        log.log('reusing {} read by a previous run'.format(key[1]))
+    else:
+        shared_inputs[key] = read()
+    return shared_inputs[key]
+
+# convert options from a manifest section to command-line arguments, e.g. {'pheno': ['A', 'B'], 'resume': None}
+# to ['--pheno', 'A', 'B', '--resume']
+def manifest_options_to_args(options):
+    argv = []
+    for key, value in options.items():
+        argv.append('--' + key)
+        if value is None:
+            continue
+        argv.extend([str(x) for x in value] if isinstance(value, list) else [str(value)])
+    return argv
+
+# read --manifest and return arguments of 'gwas.py gwas' for each combination of cohort and trait; shared inputs
+# of all runs are kept in the same dict, and --pheno-file of each run loads columns needed by all runs
+def read_plan_manifest(args, log):
+    log.log('reading {}...'.format(args.manifest))
+    manifest = yaml.safe_load(open(args.manifest, 'r'))
+    for section in ['cohorts', 'traits']:
+        if not manifest.get(section):
+            raise ValueError('--manifest must have a non-empty {} list'.format(section))
+        names = [entry.get('name') for entry in manifest[section]]
+        if (None in names) or (len(set(names)) != len(names)):
+            raise ValueError('each entry of {} in --manifest must have a unique name'.format(section))
+
+    runs, configs, shared_inputs = [], {}, {}
+    for cohort in manifest['cohorts']:
+        for trait in manifest['traits']:
+            options = dict(manifest.get('defaults') or {})
+            options.update({key: value for key, value in cohort.items() if key != 'name'})
+            options.update({key: value for key, value in trait.items() if key != 'name'})
+            for key in ['out', 'log', 'log-append']:
+                options.pop(key, None)
+            run_args = parse_args(['gwas'] + manifest_options_to_args(options) +
+                                  ['--out', os.path.join(args.out, str(cohort['name']), str(trait['name']))])
+            if run_args.config not in configs:
+                configs[run_args.config] = yaml.safe_load(open(run_args.config, "r"))
+            run_args.config_object = configs[run_args.config]
+            run_args.shared_inputs = shared_inputs
+            runs.append(run_args)
+
+    for run_args in runs:
+        run_args.plan_columns = list(dict.fromkeys(
+            column for other in runs if other.pheno_file == run_args.pheno_file
+            for column in other.pheno + other.covar + (other.variance_standardize or [])))
+    log.log('{} runs planned for {} cohorts and {} traits'.format(
+        len(runs), len(manifest['cohorts']), len(manifest['traits'])))
+    return runs
+
+# generate jobs of each combination of cohort and trait in --manifest, as 'gwas.py gwas' does, in <out>/<cohort>
+# folders; <out>_submit.sh and <out>_cmd.sh call submit and command scripts of all runs
+def execute_plan(args, log):
+    if not args.manifest:
+        raise ValueError('--manifest is required.')
+    check_input_file(args.manifest)
+    runs = read_plan_manifest(args, log)
+
+    for index, run_args in enumerate(runs, start=1):
+        log.log('generating jobs for {} ({} of {})...'.format(run_args.out, index, len(runs)))
+        os.makedirs(os.path.dirname(run_args.out), exist_ok=True)
+        execute_gwas(run_args, log)
+
+    for fname, suffix in [(args.out + '_submit.sh', '_submit.sh'), (args.out + '_cmd.sh', '_cmd.sh')]:
+        with open(fname, 'w') as f:
+            f.write('#!/bin/bash\n' + ''.join('bash {}{}\n'.format(run_args.out, suffix) for run_args in runs))
+    log.log("To submit jobs of all runs via SLURM, use {}_submit.sh, otherwise execute {}_cmd.sh".format(
+        args.out, args.out))
+
+# add jobs of GWAS analysis of args.pheno to the job graph; names of the jobs end with suffix
+def add_gwas_jobs(args, log, jobs, logistic, array_spec, task_labels, suffix):
+    info_array_spec = array_spec
+    if args.qc_cache:
+        args.qc_cache_dir = plink2_info_cache_dir(args)
+        os.makedirs(args.qc_cache_dir, exist_ok=True)
+        info_array_spec = [task_id for task_id in array_spec if not all(
+            os.path.exists(qc_basename(args).replace('@', label) + ext)
+            for label in task_labels[task_id] for ext in ['.afreq', '.hardy', '.vmiss'])]
+        log.log('QC metrics for {} of {} tasks found in {}'.format(
+            len(array_spec) - len(info_array_spec), len(array_spec), args.qc_cache_dir))
+
+    pheno_files = [args.out + '.pheno'] + ([args.out + '.covar'] if args.covar else [])
+    filter_files = [fname for fname in [args.extract, args.exclude, args.extract_step1, args.exclude_step1,
+                                        args.extract_step2, args.exclude_step2] if fname]
+    geno_files = [args.geno_file] + ([args.out + '.shards'] if args.shard_variants else [])
+    info_files = [qc_basename(args) + ext for ext in ['.afreq', '.hardy', '.vmiss']]
+    sumstats_files = [fname for pheno in args.pheno for fname in merged_sumstats_files(args, pheno)]
 
     if 'plink2' in args.analysis:
-        commands = [make_plink2_info_commands(args),
-                    make_plink2_glm_commands(args, logistic)]
-        num_jobs = append_job(args, commands, args.chr2use, num_jobs + 1, cmd_file, submit_jobs)
-
-        commands = [make_plink2_merge_commands(args, logistic)]
-        num_jobs = append_job(args, commands, None, num_jobs + 1, cmd_file, submit_jobs)
+        glm_files = ['{}_chr@.{}.glm.{}'.format(args.out, pheno, 'logistic' if logistic else 'linear')
+                     for pheno in args.pheno]
+        if info_array_spec:
+            jobs.add('plink2_info' + suffix, [make_shard_loop(args, make_plink2_info_commands(args))],
+                     info_array_spec, inputs=geno_files + [args.out + '.pheno'] + filter_files, outputs=info_files)
+        jobs.add('plink2_glm' + suffix, [make_shard_loop(args, make_plink2_glm_commands(args, logistic))],
+                 array_spec, inputs=geno_files + pheno_files + filter_files, outputs=glm_files)
+        jobs.add('plink2_merge' + suffix, [make_plink2_merge_commands(args, logistic)],
+                 inputs=glm_files + info_files + ([args.info_file] if args.info_file else []),
+                 outputs=sumstats_files)
 
     if 'regenie' in args.analysis:
-        commands = [make_regenie_commands(args, logistic, step=1)]
-        num_jobs = append_job(args, commands, None, num_jobs + 1, cmd_file, submit_jobs)
-
-        commands = [make_plink2_info_commands(args), make_regenie_commands(args, logistic, step=2)]
-        num_jobs = append_job(args, commands, args.chr2use, num_jobs + 1, cmd_file, submit_jobs)
-
-        commands = [make_regenie_merge_commands(args, logistic)]
-        num_jobs = append_job(args, commands, None, num_jobs + 1, cmd_file, submit_jobs)
+        pred_file = args.out + '.step1_pred.list'
+        regenie_files = ['{}_chr@_{}.regenie'.format(args.out, pheno) for pheno in args.pheno]
+        step1_commands = [make_regenie_commands(args, logistic, step=1)]
+        if args.step1_cache:
+            # .loco files are written to the cache folder, and listed with absolute paths in its step1_pred.list,
+            # which regenie writes last; hence the entry is complete if step1_pred.list exists
+            cache_dir = regenie_step1_cache_dir(args, logistic)
+            cached_pred_file = os.path.join(cache_dir, 'step1_pred.list')
+            if os.path.exists(cached_pred_file):
+                log.log('using regenie step1 predictions from {}'.format(cache_dir))
+                shutil.copyfile(cached_pred_file, pred_file)
+                step1_commands = None
+            else:
+                # step1 runs in a unique temporary folder, so that concurrent runs sharing the cache don't overwrite
+                # each other's partial outputs; .loco files are then moved to the cache, and step1_pred.list (with
+                # paths of the moved files) is moved last
+                os.makedirs(cache_dir, exist_ok=True)
+                step1_commands = [
+                    'tmp_dir=$(mktemp -d {}/tmp.XXXXXX)'.format(cache_dir),
+                    make_regenie_commands(args, logistic, step=1, step1_prefix='$tmp_dir/step1'),
+                    'mv $tmp_dir/step1_*.loco* $tmp_dir/step1.log {}/'.format(cache_dir),
+                    'sed "s#$tmp_dir/#{}/#" $tmp_dir/step1_pred.list > $tmp_dir/pred.list'.format(cache_dir),
+                    'mv $tmp_dir/pred.list {}'.format(cached_pred_file),
+                    'rm -rf $tmp_dir',
+                    'cp {} {}'.format(cached_pred_file, pred_file)]
+        if step1_commands:
+            jobs.add('regenie_step1' + suffix, step1_commands,
+                     inputs=[args.geno_fit_file] + pheno_files + filter_files, outputs=[pred_file])
+        if info_array_spec:
+            jobs.add('plink2_info' + suffix, [make_shard_loop(args, make_plink2_info_commands(args))],
+                     info_array_spec, inputs=geno_files + [args.out + '.pheno'] + filter_files, outputs=info_files)
+        jobs.add('regenie_step2' + suffix, [make_shard_loop(args, make_regenie_commands(args, logistic, step=2))],
+                 array_spec,
+                 inputs=geno_files + [pred_file] + pheno_files + filter_files, outputs=regenie_files)
+        jobs.add('regenie_merge' + suffix, [make_regenie_merge_commands(args, logistic)],
+                 inputs=regenie_files + info_files + ([args.info_file] if args.info_file else []),
+                 outputs=sumstats_files)
 
-    commands = []
     if 'figures' in args.analysis:
-        commands.append(make_figures_commands(args))
-    if commands:
-        num_jobs = append_job(args, commands, None, num_jobs + 1, cmd_file, submit_jobs)
-
-    log.log("To submit all jobs via SLURM, use the following scripts "
-            "otherwise execute commands from {}".format(cmd_file))
-    print('\n'.join(submit_jobs))
+        jobs.add('figures' + suffix, [make_figures_commands(args)], inputs=sumstats_files,
+                 outputs=['{}_{}.{}.png'.format(args.out, pheno, what) for pheno in args.pheno
+                          for what in ['qq', 'manh']])
+
+def read_info_file(args, log):
+    log.log('reading {}...'.format(args.info_file))
+    chr2use = args.chr2use if ('@' in args.info_file) else ['@']
+    info = pd.concat([pd.read_csv(args.info_file.replace('@', chri), delim_whitespace=True,
+                     dtype={'INFO': np.float32})[['SNP', 'INFO']] for chri in chr2use])
+    if np.any(info['SNP'].duplicated()):
+        raise ValueError("SNP column has duplicated values in --info-file file")
+    log.log('done, {} rows, {} cols'.format(len(info), info.shape[1]))
+    return info
+
+# with --shards, map each chromosome to labels of its segments in base-pair order; otherwise to its own label
+def fix_and_validate_shards(args, log):
+    if not args.shards:
+        args.segments = {chri: [chri] for chri in args.chr2use}
+        return
+    check_input_file(args.shards)
+    shards = pd.read_csv(args.shards, sep='\t', dtype={'CHR': str, 'LABEL': str})
+    args.segments = {chri: list(shards.loc[shards['CHR'] == chri].sort_values('FROM_BP')['LABEL'].values)
+                     for chri in args.chr2use}
+    log.log('{} segments of {} chromosomes are read from {}'.format(
+        len(shards), len(shards['CHR'].unique()), args.shards))
+
+def segment_labels(args):
+    return [label for chri in args.chr2use for label in args.segments[chri]]
+
+def read_plink2_qc_file(args, suffix, columns, log):
+    log.log('reading {}{}...'.format(args.basename, suffix))
+    df = pd.concat([pd.read_csv(args.basename.replace('@', label) + suffix,
+                   delim_whitespace=True)[['ID'] + columns] for label in segment_labels(args)])
+    if np.any(df['ID'].duplicated()):
+        raise ValueError(
+            "ID column has duplicated values in {}{} file - "
+            "have your .bim file had duplicated SNPs?".format(args.basename, suffix))
+    log.log('done, {} rows, {} cols'.format(len(df), df.shape[1]))
+    return df.rename(columns={'ID': 'SNP'})
+
+class VariantIndex(object):
+    '''
+    Maps variant IDs to dense integer positions, and holds filter columns (INFO, ALT_FREQS, etc) as arrays aligned to
+    these positions. This way each chunk of summary statistics is hashed once, instead of once per filter table.
+    '''
 
-def apply_filters(args, df):
-    info_col = []
+    def __init__(self, tables):
+        # tables - dict of column name -> DataFrame with SNP and value columns
+        codes, uniques = pd.factorize(np.concatenate([df['SNP'].values for df in tables.values()]))
+        self.index = pd.Index(uniques)
+        self.index.get_indexer(self.index[:1])  # build the hash table now, before worker processes are forked
+
+        # each column has an extra trailing element, used for variants absent from the index
+        self.columns = {}
+        offset = 0
+        for name, df in tables.items():
+            pos = codes[offset:(offset + len(df))]
+            offset += len(df)
+            values = df[df.columns[df.columns != 'SNP'][0]].values
+            self.columns[name] = np.full(len(self.index) + 1, np.nan, dtype=np.result_type(values.dtype, np.float32))
+            self.columns[name][pos] = values
+            self.columns[name + '_present'] = np.zeros(len(self.index) + 1, dtype=bool)
+            self.columns[name + '_present'][pos] = True
+
+    def get_positions(self, snp):
+        pos = self.index.get_indexer(snp)
+        pos[pos < 0] = len(self.index)
+        return pos
+
+# read all tables needed by apply_filters into a VariantIndex; this is done once per merge,
+# while apply_filters may be called many times
+def read_variant_index(args, log):
+    filter_tables = {}
     if (args.info is not None) or (args.info_file is not None):
         if (args.info is None) or (args.info_file is None):
             raise ValueError('both --info and --info-file must be used at the same time')
-        log.log('reading {}...'.format(args.info_file))
-        chr2use = args.chf2use if ('@' in args.info_file) else ['@']
-        info = pd.concat([pd.read_csv(args.info_file.replace('@', chri), delim_whitespace=True,
-                         dtype={'INFO': np.float32})[['SNP', 'INFO']] for chri in chr2use])
-        if np.any(info['SNP'].duplicated()):
-            raise ValueError("SNP column has duplicated values in --info-file file")
-        log.log('done, {} rows, {} cols'.format(len(info), info.shape[1]))
-
-        log.log("merging --sumstats (n={} rows) and --info-file...".format(len(df)))
-        df = pd.merge(df, info, how='inner', on='SNP')
-        log.log("n={} SNPs remain after merging, n={} with missing INFO score".format(
-            len(df), np.sum(df['INFO'].isnull())))
-
-        n = len(df)
-        df = df[~(df['INFO'] < args.info)].copy()
-        log.log("n={} SNPs remain after filtering INFO>={}, n={} removed".format(len(df), args.info, n - len(df)))
-        info_col = ['INFO']
-
+        filter_tables['INFO'] = read_info_file(args, log)
     if args.maf is not None:
-        maf = pd.concat([pd.read_csv(args.basename.replace('@', chri) + '.afreq',
-                        delim_whitespace=True)[['ID', 'ALT_FREQS']] for chri in args.chr2use])
-        if np.any(maf['ID'].duplicated()):
-            raise ValueError(
-                "ID column has duplicated values in {}.afreq file - "
-                "have your .bim file had duplicated SNPs?".format(args.basename))
-        maf.rename(columns={'ID': 'SNP'}, inplace=True)
-        df = pd.merge(df, maf, how='left', on='SNP')
-        n = len(df)
-        df = df[(df['ALT_FREQS'] >= args.maf) & (df['ALT_FREQS'] <= (1 - args.maf))].copy()
-        log.log("n={} SNPs remain after filtering allele frequency on {}<=FRQ<={}, n={} removed".format(
-            len(df), args.maf, 1 - args.maf, n - len(df)))
-
+        filter_tables['ALT_FREQS'] = read_plink2_qc_file(args, '.afreq', ['ALT_FREQS'], log)
     if args.hwe is not None:
-        hwe = pd.concat([pd.read_csv(args.basename.replace('@', chri) + '.hardy',
-                        delim_whitespace=True)[['ID', 'P']] for chri in args.chr2use])
-        if np.any(hwe['ID'].duplicated()):
-            raise ValueError(
-                "ID column has duplicated values in {}.hardy file - "
-                "have your .bim file had duplicated SNPs?".format(args.basename))
-        hwe.rename(columns={'ID': 'SNP', 'P': 'P_HWE'}, inplace=True)
-        df = pd.merge(df, hwe, how='left', on='SNP')
-        n = len(df)
-        df = df[df['P_HWE'] >= args.hwe].copy()
-        log.log("n={} SNPs remain after filtering Hardy Weinberg equilibrium P>={}, n={} removed".format(
-            len(df), args.hwe, n - len(df)))
-        del df['P_HWE']
-
+        filter_tables['P_HWE'] = read_plink2_qc_file(args, '.hardy', ['P'], log)
     if args.geno is not None:
-        vmiss = pd.concat([pd.read_csv(args.basename.replace('@', chri) + '.vmiss',
-                          delim_whitespace=True)[['ID', 'F_MISS']] for chri in args.chr2use])
-        if np.any(vmiss['ID'].duplicated()):
-            raise ValueError(
-                "ID column has duplicated values in {}.vmiss file - "
-                "have your .bim file had duplicated SNPs?".format(args.basename))
-        vmiss.rename(columns={'ID': 'SNP'}, inplace=True)
-        df = pd.merge(df, vmiss, how='left', on='SNP')
-        n = len(df)
-        df = df[df['F_MISS'] <= args.geno].copy()
-        log.log("n={} SNPs remain after filtering SNPs missingness F_MISS>={}, n={} removed".format(
-            len(df), args.geno, n - len(df)))
-        del df['F_MISS']
-
-    return df, info_col
+        filter_tables['F_MISS'] = read_plink2_qc_file(args, '.vmiss', ['F_MISS'], log)
+    if not filter_tables:
+        return None
+
+    variant_index = VariantIndex(filter_tables)
+    log.log('indexed n={} unique variants across filter tables'.format(len(variant_index.index)))
+    return variant_index
+
+# apply filters to a chunk of sumstats; 'counts' accumulates the number of SNPs removed at each step
+def apply_filters(args, df, variant_index, counts):
+    if variant_index is None:
+        return df
+
+    pos = variant_index.get_positions(df['SNP'].values)
+    columns = variant_index.columns
+    mask = np.ones(len(df), dtype=bool)
+
+    def count(label, keep):
+        counts[label] = counts.get(label, 0) + int(np.sum(mask & ~keep))
+        return mask & keep
+
+    if 'INFO' in columns:
+        mask = count('merging with --info-file', columns['INFO_present'][pos])
+        mask = count('filtering INFO>={}'.format(args.info), ~(columns['INFO'][pos] < args.info))
+
+    if 'ALT_FREQS' in columns:
+        frq = columns['ALT_FREQS'][pos]
+        mask = count('filtering allele frequency on {}<=FRQ<={}'.format(args.maf, 1 - args.maf),
+                     (frq >= args.maf) & (frq <= (1 - args.maf)))
+
+    if 'P_HWE' in columns:
+        mask = count('filtering Hardy Weinberg equilibrium P>={}'.format(args.hwe), columns['P_HWE'][pos] >= args.hwe)
+
+    if 'F_MISS' in columns:
+        mask = count('filtering SNPs missingness F_MISS<={}'.format(args.geno), columns['F_MISS'][pos] <= args.geno)
+
+    df = df[mask]
+    if 'INFO' in columns:
+        df = df.assign(INFO=columns['INFO'][pos[mask]])
+    return df
+
+def log_filter_counts(log, n, counts):
+    for label, removed in counts.items():
+        n -= removed
+        log.log("n={} SNPs remain after {}, n={} removed".format(n, label, removed))
+
+
+# BGZF (block gzip) format, as used by htslib (bgzip, tabix); see https://samtools.github.io/hts-specs/SAMv1.pdf
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+TABIX_MIN_SHIFT = 14
+
+def bgzf_compress_block(data, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<BBBBIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25)
+    return header + cdata + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+class BgzfWriter(object):
+    '''
+    Writes BGZF-compressed files (readable by gzip / zcat), compressing blocks in a pool of threads.
+    '''
+
+    def __init__(self, fname, threads=1):
+        self.fh = open(fname, 'wb')
+        self.offset = 0
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads) if (threads > 1) else None
+
+    # write 'data' (bytes), splitting it into blocks at line boundaries so that no line spans two blocks;
+    # returns virtual offsets of the start and the end of each line
+    def write_lines(self, data):
+        line_ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n')) + 1
+        block_ends = []
+        start = 0
+        while start < len(data):
+            index = np.searchsorted(line_ends, start + BGZF_BLOCK_SIZE, side='right') - 1
+            if (index < 0) or (line_ends[index] <= start):
+                raise ValueError('line is too long for BGZF block')
+            start = int(line_ends[index])
+            block_ends.append(start)
+
+        block_starts = [0] + block_ends[:-1]
+        blocks = [data[a:b] for a, b in zip(block_starts, block_ends)]
+        mapper = self.executor.map if self.executor else map
+        compressed = mapper(bgzf_compress_block, blocks)
+        block_offsets = []
+        for cdata in compressed:
+            block_offsets.append(self.offset)
+            self.fh.write(cdata)
+            self.offset += len(cdata)
+
+        # virtual offsets (compressed block offset << 16 | offset within block) of the start and end of each line;
+        # a line ending at the end of a block ends at the start of the next block, as reported by htslib's bgzf_tell
+        block_offsets = np.array(block_offsets + [self.offset], dtype=np.uint64) << np.uint64(16)
+        block_starts = np.array(block_starts + [len(data)], dtype=np.int64)
+        block_ends = np.array(block_ends, dtype=np.int64)
+        line_starts = np.concatenate([[0], line_ends[:-1]])
+        start_block = np.searchsorted(block_ends, line_starts, side='right')
+        end_block = np.searchsorted(block_ends, line_ends, side='right')
+        vbeg = block_offsets[start_block] | (line_starts - block_starts[start_block]).astype(np.uint64)
+        vend = block_offsets[end_block] | (line_ends - block_starts[end_block]).astype(np.uint64)
+        return vbeg, vend
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+        self.fh.write(BGZF_EOF)
+        self.fh.close()
+
+class TabixIndex(object):
+    '''
+    Tabix (.tbi) index over CHR and BP columns of a BGZF-compressed text file with one header line,
+    allowing tools such as 'tabix out.gz 1:10000-20000' to read a region without decompressing the whole file.
+    '''
+
+    def __init__(self, col_seq, col_pos):
+        self.col_seq, self.col_pos = col_seq, col_pos  # 1-based column indices
+        self.refs = {}  # CHR -> (bins, linear index), bins is a dict of bin -> list of [chunk_beg, chunk_end]
+        self.last = None
+        self.error = None
+
+    # add records with given chromosome and positions, and their virtual offsets of record start and end
+    def add(self, chri, pos, vbeg, vend):
+        if self.error or (len(pos) == 0):
+            return
+        if (self.last is not None) and (self.last[0] != chri) and (chri in self.refs):
+            self.error = 'chromosome {} is not contiguous'.format(chri)
+            return
+        if np.any(np.diff(pos) < 0) or ((self.last is not None) and (self.last[0] == chri) and (pos[0] < self.last[1])):
+            self.error = 'chromosome {} is not sorted by BP'.format(chri)
+            return
+        self.last = (chri, pos[-1])
+        bins, linear = self.refs.setdefault(chri, ({}, {}))
+
+        # single-base records always fall into the smallest (16 kbp) bins, 4681 + (beg >> 14)
+        window = (pos - 1) >> TABIX_MIN_SHIFT
+        run_starts = np.flatnonzero(np.concatenate([[True], window[1:] != window[:-1]]))
+        run_ends = np.concatenate([run_starts[1:], [len(pos)]]) - 1
+        for start, end in zip(run_starts, run_ends):
+            chunks = bins.setdefault(4681 + int(window[start]), [])
+            if chunks and (chunks[-1][1] == vbeg[start]):
+                chunks[-1][1] = int(vend[end])
+            else:
+                chunks.append([int(vbeg[start]), int(vend[end])])
+            linear.setdefault(int(window[start]), int(vbeg[start]))
+
+    def write(self, fname):
+        names = b''.join(str(chri).encode() + b'\0' for chri in self.refs)
+        # header: n_ref, format (generic), col_seq, col_beg, col_end, meta character, lines to skip, l_nm
+        data = b'TBI\1' + struct.pack('<8i', len(self.refs), 0, self.col_seq, self.col_pos, self.col_pos,
+                                      ord('#'), 1, len(names))
+        data += names
+        for bins, linear in self.refs.values():
+            data += struct.pack('<i', len(bins))
+            for bin_id, chunks in bins.items():
+                data += struct.pack('<Ii', bin_id, len(chunks))
+                data += b''.join(struct.pack('<QQ', beg, end) for beg, end in chunks)
+            # windows without records point to the first record after them
+            ioff = np.zeros(max(linear) + 1, dtype=np.uint64)
+            for window, offset in linear.items():
+                ioff[window] = offset
+            for i in reversed(range(len(ioff) - 1)):
+                if i not in linear:
+                    ioff[i] = ioff[i + 1]
+            data += struct.pack('<i', len(ioff)) + ioff.tobytes()
+        with open(fname, 'wb') as f:
+            for start in range(0, len(data), BGZF_BLOCK_SIZE):
+                f.write(bgzf_compress_block(data[start:(start + BGZF_BLOCK_SIZE)]))
+            f.write(BGZF_EOF)
+
+# write merged summary statistics as <out>.gz (BGZF-compressed) and <out>.gz.tbi (tabix index on CHR and BP)
+class BgzfSumstatsWriter(object):
+    def __init__(self, args, c2w, log):
+        self.c2w, self.log = c2w, log
+        self.fname = args.out + '.gz'
+        self.bgzf = BgzfWriter(self.fname + '.tmp', threads=args.threads)
+        self.bgzf.write_lines(('\t'.join(c2w) + '\n').encode())
+        self.index = TabixIndex(col_seq=c2w.index('CHR') + 1, col_pos=c2w.index('BP') + 1)
+
+    def write(self, df):
+        vbeg, vend = self.bgzf.write_lines(df[self.c2w].to_csv(None, index=False, sep='\t', header=False).encode())
+        chrom, pos = df['CHR'].astype(str).values, df['BP'].values.astype(np.int64)
+        run_starts = np.flatnonzero(np.concatenate([[True], chrom[1:] != chrom[:-1]]))
+        for start, end in zip(run_starts, np.concatenate([run_starts[1:], [len(df)]])):
+            self.index.add(chrom[start], pos[start:end], vbeg[start:end], vend[start:end])
+
+    # <out>.gz and <out>.gz.tbi are written as .tmp files and renamed once complete, so that a failed merge
+    # doesn't leave a truncated output that looks valid (e.g. to --resume)
+    def close(self):
+        self.bgzf.close()
+        if os.path.exists(self.fname + '.tbi'):
+            os.remove(self.fname + '.tbi')
+        if self.index.error:
+            self.log.log('WARNING: {} is not indexed, {}'.format(self.fname, self.index.error))
+        else:
+            self.index.write(self.fname + '.tbi.tmp')
+        os.replace(self.fname + '.tmp', self.fname)
+        if not self.index.error:
+            os.replace(self.fname + '.tbi.tmp', self.fname + '.tbi')
+        self.log.log('{} written'.format(self.fname))
+
+    def abort(self):
+        self.bgzf.close()
+        os.remove(self.fname + '.tmp')
+
+# write merged summary statistics as a columnar dataset partitioned by chromosome, i.e.
+# <out>.parquet/CHR=<chr>/part-<n>.parquet (or .feather), which can be loaded with, for example,
+# pd.read_parquet('<out>.parquet', columns=['SNP', 'P'], filters=[('CHR', '==', 1)])
+class ColumnarSumstatsWriter(object):
+    def __init__(self, args, c2w, log, out_format):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+            import pyarrow.ipc
+        except ImportError:
+            raise ValueError('--out-format {} requires pyarrow package'.format(out_format))
+        self.pa, self.out_format, self.log = pyarrow, out_format, log
+        self.dirname = '{}.{}'.format(args.out, out_format)
+        self.tmp_dirname = self.dirname + '.tmp'
+        if os.path.isdir(self.tmp_dirname):
+            shutil.rmtree(self.tmp_dirname)
+
+        types = {'SNP': pyarrow.string(), 'A1': pyarrow.string(), 'A2': pyarrow.string(), 'BP': pyarrow.int64(),
+                 'N': pyarrow.int64(), 'CaseN': pyarrow.int64(), 'ControlN': pyarrow.int64(),
+                 'INFO': pyarrow.float32()}
+        self.columns = [col for col in c2w if col != 'CHR']
+        self.schema = pyarrow.schema([(col, types.get(col, pyarrow.float64())) for col in self.columns])
+        self.chri, self.writer, self.parts = None, None, {}
+
+    def open_partition(self, chri):
+        self.close_partition()
+        part = self.parts.get(chri, 0)
+        self.parts[chri] = part + 1
+        os.makedirs(os.path.join(self.tmp_dirname, 'CHR={}'.format(chri)), exist_ok=True)
+        fname = os.path.join(self.tmp_dirname, 'CHR={}'.format(chri), 'part-{}.{}'.format(part, self.out_format))
+        if self.out_format == 'parquet':
+            self.writer = self.pa.parquet.ParquetWriter(fname, self.schema)
+        else:
+            self.writer = self.pa.ipc.new_file(fname, self.schema)
+        self.chri = chri
+
+    def close_partition(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.chri, self.writer = None, None
+
+    def write(self, df):
+        chrom = df['CHR'].astype(str).values
+        run_starts = np.flatnonzero(np.concatenate([[True], chrom[1:] != chrom[:-1]]))
+        for start, end in zip(run_starts, np.concatenate([run_starts[1:], [len(df)]])):
+            if chrom[start] != self.chri:
+                self.open_partition(chrom[start])
+            table = self.pa.Table.from_pandas(df[self.columns].iloc[start:end], schema=self.schema,
+                                              preserve_index=False)
+            self.writer.write_table(table)
+
+    # the dataset is written to <out>.<format>.tmp, which replaces <out>.<format> once complete
+    def close(self):
+        self.close_partition()
+        os.makedirs(self.tmp_dirname, exist_ok=True)
+        if os.path.isdir(self.dirname):
+            shutil.rmtree(self.dirname)
+        os.replace(self.tmp_dirname, self.dirname)
+        self.log.log('{} written, {} chromosomes'.format(self.dirname, len(self.parts)))
+
+    def abort(self):
+        self.close_partition()
+        if os.path.isdir(self.tmp_dirname):
+            shutil.rmtree(self.tmp_dirname)
+
+# write merged summary statistics in all formats requested by --out-format
+class SumstatsWriter(object):
+    def __init__(self, args, c2w, log):
+        self.writers = [(BgzfSumstatsWriter(args, c2w, log) if (out_format == 'gz') else
+                         ColumnarSumstatsWriter(args, c2w, log, out_format)) for out_format in args.out_format]
+
+    def write(self, df):
+        if len(df) == 0:
+            return
+        for writer in self.writers:
+            writer.write(df)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    # remove temporary files of all formats, leaving outputs of previous runs (if any) unchanged
+    def abort(self):
+        for writer in self.writers:
+            writer.abort()
+
+# accumulates summary of merged statistics chunk by chunk, so that it does not require re-reading the output:
+# genomic control lambda (from a fine histogram of P-values), number of genome-wide significant and suggestive
+# variants, and per-chromosome counts with the lead variant
+class SumstatsSummary(object):
+    P_BINS = 1000000
+    P_GWS = 5e-8
+    P_SUGGESTIVE = 1e-5
+
+    def __init__(self):
+        self.hist = np.zeros(SumstatsSummary.P_BINS, dtype=np.int64)
+        self.chromosomes = {}
+
+    def add(self, df):
+        pval = df['P'].values.astype(np.float64)
+        valid = np.isfinite(pval)
+        self.hist += np.bincount(np.clip((pval[valid] * SumstatsSummary.P_BINS).astype(np.int64),
+                                         0, SumstatsSummary.P_BINS - 1), minlength=SumstatsSummary.P_BINS)
+        for chri, df_chr in df[valid].groupby('CHR', sort=False):
+            lead = df_chr['P'].values.argmin()
+            stat = self.chromosomes.setdefault(str(chri), {'n': 0, 'n_gws': 0, 'n_suggestive': 0, 'min_p': None})
+            stat['n'] += len(df_chr)
+            stat['n_gws'] += int(np.sum(df_chr['P'].values < SumstatsSummary.P_GWS))
+            stat['n_suggestive'] += int(np.sum(df_chr['P'].values < SumstatsSummary.P_SUGGESTIVE))
+            if (stat['min_p'] is None) or (df_chr['P'].values[lead] < stat['min_p']):
+                stat.update({'min_p': float(df_chr['P'].values[lead]), 'lead_snp': str(df_chr['SNP'].values[lead]),
+                             'lead_bp': int(df_chr['BP'].values[lead])})
+
+    # median P-value, linearly interpolated within histogram bin
+    def median_p(self):
+        n = np.sum(self.hist)
+        cumsum = np.cumsum(self.hist)
+        k = int(np.searchsorted(cumsum, n / 2.0))
+        before = cumsum[k] - self.hist[k]
+        return (k + (n / 2.0 - before) / self.hist[k]) / SumstatsSummary.P_BINS
+
+    def to_dict(self, totals, counts):
+        n = int(np.sum(self.hist))
+        lambda_gc = (stats.chi2.isf(self.median_p(), 1) / stats.chi2.ppf(0.5, 1)) if (n > 0) else None
+        return {'n_read': int(totals['read']), 'n_valid': int(totals['valid']),
+                'n_removed_by_filter': {label: int(count) for label, count in counts.items()},
+                'n': n, 'lambda_gc': lambda_gc,
+                'n_gws': sum(stat['n_gws'] for stat in self.chromosomes.values()),
+                'n_suggestive': sum(stat['n_suggestive'] for stat in self.chromosomes.values()),
+                'p_gws': SumstatsSummary.P_GWS, 'p_suggestive': SumstatsSummary.P_SUGGESTIVE,
+                'chromosomes': self.chromosomes}
 
 def write_readme_file(args):
     with open(args.out + '.README.txt', 'w') as f:
@@ -810,56 +1731,333 @@ P        - p-value
 For more information, see .log files produced by gwas.py and sebsequent runs.
 ''')
 
-def merge_plink2(args, log):
-    fix_and_validate_chr2use(args, log)
-    pattern = args.sumstats
-    stat = 'T_STAT' if pattern.endswith('.glm.linear') else 'Z_STAT'
-    effect_cols = (['BETA', "SE"] if pattern.endswith('.glm.linear') else ['OR', 'LOG(OR)_SE'])
-    ct_cols = ([] if pattern.endswith('.glm.linear') else ["CASE_ALLELE_CT", "CTRL_ALLELE_CT"])
-    check_input_file(pattern, args.chr2use)
-    df = pd.concat([pd.read_csv(pattern.replace('@', chri), delim_whitespace=True)[
-        ['ID', '#CHROM', 'POS', 'REF', 'ALT', 'A1', 'A1_FREQ',
-         'OBS_CT', stat, 'P', 'L95', 'U95'] + ct_cols + effect_cols] for chri in args.chr2use])
-    df['A2'] = df['REF']
-    idx = df['A2'] == df['A1']
-    df.loc[idx, 'A2'] = df.loc[idx, 'ALT']
+def read_sumstats_chunks(fname, usecols, chunksize):
+    if chunksize is None:
+        yield pd.read_csv(fname, delim_whitespace=True, usecols=usecols)
+    else:
+        yield from pd.read_csv(fname, delim_whitespace=True, usecols=usecols, chunksize=chunksize)
+
+# read one chromosome of --sumstats (chunk by chunk if --chunksize is set), convert each chunk with 'transform'
+# and apply filters; 'totals' and 'counts' accumulate the number of SNPs read and removed by each filter
+def merge_chromosome(args, log, chri, usecols, transform, variant_index, totals, counts):
+    for label in args.segments[chri]:
+        fname = args.sumstats_files[label]
+        log.log('reading {}...'.format(fname))
+        for df in read_sumstats_chunks(fname, usecols, args.chunksize):
+            totals['read'] += len(df)
+            df = transform(df).dropna()
+            totals['valid'] += len(df)
+            yield apply_filters(args, df, variant_index, counts)
+
+# collects messages of a worker process, so that they are logged by the parent process in chromosome order
+class LogBuffer(object):
+    def __init__(self):
+        self.messages = []
+
+    def log(self, msg):
+        self.messages.append(msg)
+
+
+# state shared with worker processes of merge_phenotypes; workers are forked, so the variant index is not copied
+_merge_context = None
+
+
+def merge_chromosome_tmp_file(args, chri):
+    return '{}.chr{}.merge.tmp'.format(args.out, chri)
+
+# process one chromosome in a worker process, writing chunks one by one to a temporary file (a sequence of
+# pickled data frames), so that neither the worker nor the parent holds more than one chunk in memory
+def merge_chromosome_worker(task):
+    args, chri = task
+    usecols, transform, variant_index = _merge_context
+    worker_log, totals, counts = LogBuffer(), {'read': 0, 'valid': 0}, {}
+    with open(merge_chromosome_tmp_file(args, chri), 'wb') as f:
+        for df in merge_chromosome(args, worker_log, chri, usecols, transform, variant_index, totals, counts):
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return worker_log.messages, totals, counts
+
+# iterate over processed chunks of all chromosomes in --chr2use order,
+# either in the current process or (with --threads) in a pool of worker processes (see merge_phenotypes)
+def iterate_merged_chunks(args, log, pool, usecols, transform, variant_index, totals, counts):
+    if pool is None:
+        for chri in args.chr2use:
+            yield from merge_chromosome(args, log, chri, usecols, transform, variant_index, totals, counts)
+        return
+
+    completed = False
+    try:
+        results = pool.imap(merge_chromosome_worker, [(args, chri) for chri in args.chr2use])
+        for chri, (messages, chr_totals, chr_counts) in zip(args.chr2use, results):
+            for msg in messages:
+                log.log(msg)
+            for key, value in chr_totals.items():
+                totals[key] += value
+            for key, value in chr_counts.items():
+                counts[key] = counts.get(key, 0) + value
+            tmp_file = merge_chromosome_tmp_file(args, chri)
+            with open(tmp_file, 'rb') as f:
+                while True:
+                    try:
+                        df = pickle.load(f)
+                    except EOFError:
+                        break
+                    yield df
+            os.remove(tmp_file)
+        completed = True
+    finally:
+        if not completed:
+            pool.terminate()  # stop workers before their temporary files are removed
+        for chri in args.chr2use:
+            if os.path.exists(merge_chromosome_tmp_file(args, chri)):
+                os.remove(merge_chromosome_tmp_file(args, chri))
+
+# merge --sumstats across chromosomes, apply filters, and write 'c2w' columns to the output file
+def merge_sumstats(args, log, usecols, transform, c2w, variant_index, pool=None):
+    if (variant_index is not None) and ('INFO' in variant_index.columns):
+        c2w = c2w[:c2w.index('FRQ')] + ['INFO'] + c2w[c2w.index('FRQ'):]
+
+    totals, counts = {'read': 0, 'valid': 0}, {}
+    writer, summary = SumstatsWriter(args, c2w, log), SumstatsSummary()
+    try:
+        for df in iterate_merged_chunks(args, log, pool, usecols, transform, variant_index, totals, counts):
+            writer.write(df)
+            summary.add(df)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+    log.log("n={} SNPs read from --sumstats, n={} remain after removing rows with missing values".format(
+        totals['read'], totals['valid']))
+    log_filter_counts(log, totals['valid'], counts)
+    summary = summary.to_dict(totals, counts)
+    with open(args.out + '.summary.json', 'w') as f:
+        json.dump(summary, f, indent=2)
+    log.log('{}.summary.json written, lambda_gc={}, n={} genome-wide significant variants (P<{})'.format(
+        args.out, summary['lambda_gc'], summary['n_gws'], summary['p_gws']))
+    write_readme_file(args)
+
+# map each segment label to its --sumstats file, which is the first of candidates(fname) that exists
+def find_sumstats_files(args, candidates):
+    sumstats_files = {}
+    for label in segment_labels(args):
+        fnames = candidates(args.sumstats.replace('@', label))
+        sumstats_files[label] = next((fname for fname in fnames if os.path.isfile(fname)), fnames[0])
+        check_input_file(sumstats_files[label])
+    return sumstats_files
+
+# merge --sumstats of each --pheno, or just --sumstats if --pheno is not specified; all input files are checked
+# before merging starts, and filter tables are read once and shared by all phenotypes
+def merge_phenotypes(args, log, usecols, transform, c2w, candidates=lambda fname: [fname]):
+    if args.pheno and ('{pheno}' not in args.sumstats):
+        raise ValueError('--sumstats must contain {pheno} placeholder when --pheno is specified')
+    phenos = args.pheno or [None]
+    pheno_args = [args if (pheno is None) else argparse.Namespace(**dict(
+        vars(args), sumstats=args.sumstats.replace('{pheno}', pheno), out='{}_{}'.format(args.out, pheno)))
+        for pheno in phenos]
+    for merge_args in pheno_args:
+        merge_args.sumstats_files = find_sumstats_files(merge_args, candidates)
+
+    variant_index = read_variant_index(args, log)
+
+    # with --threads, chromosomes are processed by a pool of worker processes, forked before any writer starts its
+    # threads (BGZF compression, pyarrow), as a process forked while other threads hold locks may deadlock
+    global _merge_context
+    _merge_context = (usecols, transform, variant_index)
+    pool = multiprocessing.get_context('fork').Pool(min(args.threads, len(args.chr2use))) \
+        if (args.threads > 1) else None
+    try:
+        for index, (pheno, merge_args) in enumerate(zip(phenos, pheno_args)):
+            if pheno is not None:
+                log.log('merging {} ({} of {})...'.format(pheno, index + 1, len(phenos)))
+            merge_sumstats(merge_args, log, usecols, transform, c2w, variant_index, pool)
+    finally:
+        _merge_context = None
+        if pool is not None:
+            pool.terminate()
+
+# plink2 --glm writes logistic regression to .glm.logistic.hybrid (default firth-fallback) or .glm.firth (firth),
+# and to .glm.logistic only with no-firth; any of these is used for .glm.logistic in --sumstats
+def plink2_sumstats_candidates(fname):
+    if not fname.endswith('.glm.logistic'):
+        return [fname]
+    return [fname, fname + '.hybrid', replace_suffix(fname, '.glm.logistic', '.glm.firth')]
+
+def transform_plink2_sumstats(df, linear):
+    stat = 'T_STAT' if linear else 'Z_STAT'
+    df['A2'] = np.where(df['REF'] == df['A1'], df['ALT'], df['REF'])
     del df['REF']
     del df['ALT']
 
-    if not pattern.endswith('.glm.linear'):
+    if not linear:
         df['BETA'] = np.log(df['OR']).astype(np.float32)
         df['L95'] = np.log(df['L95']).astype(np.float32)
         df['U95'] = np.log(df['U95']).astype(np.float32)
         df.rename(columns={'LOG(OR)_SE': 'SE'}, inplace=True)
         df['CaseN'] = (df['CASE_ALLELE_CT'].values / 2).astype(int)
         df['ControlN'] = (df['CTRL_ALLELE_CT'].values / 2).astype(int)
-        ct_cols = ['CaseN', 'ControlN']
-
-    df.dropna(inplace=True)
-    df.rename(columns={'ID': 'SNP', '#CHROM': 'CHR', 'POS': 'BP',
-              'OBS_CT': 'N', stat: 'Z', 'A1_FREQ': 'FRQ'}, inplace=True)
-    df, info_col = apply_filters(args, df)
-    c2w = ['SNP', 'CHR', 'BP', 'A1', 'A2', 'N'] + ct_cols + info_col + ['FRQ', 'Z', 'BETA', 'SE', 'L95', 'U95', 'P']
-    df[c2w].to_csv(args.out, index=False, sep='\t')
-    os.system('gzip -f ' + args.out)
-    write_readme_file(args)
 
-def merge_regenie(args, log):
+    return df.rename(columns={'ID': 'SNP', '#CHROM': 'CHR', 'POS': 'BP',
+                              'OBS_CT': 'N', stat: 'Z', 'A1_FREQ': 'FRQ'})
+
+def merge_plink2(args, log):
     fix_and_validate_chr2use(args, log)
     pattern = args.sumstats
-    check_input_file(pattern, args.chr2use)
-    df = pd.concat([pd.read_csv(pattern.replace('@', chri), delim_whitespace=True)[['ID', 'CHROM', 'BETA',
-                   'SE', 'GENPOS', 'ALLELE0', 'ALLELE1', 'A1FREQ', 'N', 'LOG10P']] for chri in args.chr2use])
+    linear = pattern.endswith('.glm.linear')
+    stat = 'T_STAT' if linear else 'Z_STAT'
+    effect_cols = (['BETA', "SE"] if linear else ['OR', 'LOG(OR)_SE'])
+    ct_cols = ([] if linear else ["CASE_ALLELE_CT", "CTRL_ALLELE_CT"])
+    fix_and_validate_shards(args, log)
+    usecols = ['ID', '#CHROM', 'POS', 'REF', 'ALT', 'A1', 'A1_FREQ',
+               'OBS_CT', stat, 'P', 'L95', 'U95'] + ct_cols + effect_cols
+    c2w = ['SNP', 'CHR', 'BP', 'A1', 'A2', 'N'] + ([] if linear else ['CaseN', 'ControlN']) + \
+        ['FRQ', 'Z', 'BETA', 'SE', 'L95', 'U95', 'P']
+    merge_phenotypes(args, log, usecols, lambda df: transform_plink2_sumstats(df, linear), c2w,
+                     plink2_sumstats_candidates)
+
+def transform_regenie_sumstats(df):
     df['P'] = np.power(10, -df['LOG10P'])
     df['Z'] = -stats.norm.ppf(df['P'].values * 0.5) * np.sign(df['BETA']).astype(np.float64)
-    df.dropna(inplace=True)
-    df.rename(columns={'ID': 'SNP', 'CHROM': 'CHR', 'GENPOS': 'BP',
-              'ALLELE0': 'A2', 'ALLELE1': 'A1', 'A1FREQ': 'FRQ'}, inplace=True)
-    df, info_col = apply_filters(args, df)
-    c2w = ['SNP', 'CHR', 'BP', 'A1', 'A2', 'N'] + info_col + ['FRQ', 'Z', 'BETA', 'SE', 'P']
-    df[c2w].to_csv(args.out, index=False, sep='\t')
-    os.system('gzip -f ' + args.out)
-    write_readme_file(args)
+    return df.rename(columns={'ID': 'SNP', 'CHROM': 'CHR', 'GENPOS': 'BP',
+                              'ALLELE0': 'A2', 'ALLELE1': 'A1', 'A1FREQ': 'FRQ'})
+
+def merge_regenie(args, log):
+    fix_and_validate_chr2use(args, log)
+    fix_and_validate_shards(args, log)
+    usecols = ['ID', 'CHROM', 'BETA', 'SE', 'GENPOS', 'ALLELE0', 'ALLELE1', 'A1FREQ', 'N', 'LOG10P']
+    c2w = ['SNP', 'CHR', 'BP', 'A1', 'A2', 'N', 'FRQ', 'Z', 'BETA', 'SE', 'P']
+    merge_phenotypes(args, log, usecols, transform_regenie_sumstats, c2w)
+
+# accumulates -log10(P) of all variants in a single pass; variants in the tail (P < tail_p) are kept individually,
+# while the bulk of non-significant variants is binned (for QQ plot) and de-duplicated on a grid (for manhattan plot)
+# key to sort labels such as chromosomes in natural order: 1, 2, ..., 10, ..., 22, X, Y
+def natural_sort_key(label):
+    return [int(token) if token.isdigit() else token for token in re.split(r'(\d+)', label)]
+
+class PvalueBinner(object):
+    LOGP_RESOLUTION = 1e-4  # bin width for -log10(P) histogram of the bulk
+    MANH_BP_BIN = 500000    # bin width (in bp) and -log10(P) step for the bulk of manhattan plot
+    MANH_LOGP_BIN = 0.02
+
+    def __init__(self, tail_p):
+        self.tail_logp = -np.log10(tail_p)
+        self.hist = np.zeros(int(np.ceil(self.tail_logp / PvalueBinner.LOGP_RESOLUTION)) + 1, dtype=np.int64)
+        self.tail = []
+        self.grid = []
+        self.chromosomes = {}  # CHR -> max BP, in natural order of CHR labels after finalize
+
+    # NaN P values are dropped, others are clipped to [tiny, 1] so that -log10(P) is finite and non-negative
+    def add(self, chrom, bp, pval):
+        valid = ~np.isnan(pval)
+        chrom, bp = chrom[valid], bp[valid]
+        logp = -np.log10(np.clip(pval[valid], np.finfo(float).tiny, 1))
+
+        codes, labels = pd.factorize(chrom)
+        for index, label in enumerate(labels):
+            self.chromosomes[label] = max(self.chromosomes.get(label, 0), int(np.max(bp[codes == index])))
+
+        in_tail = logp >= self.tail_logp
+        self.tail.append(pd.DataFrame({'CHR': chrom[in_tail], 'BP': bp[in_tail], 'LOGP': logp[in_tail]}))
+        self.hist += np.bincount((logp[~in_tail] / PvalueBinner.LOGP_RESOLUTION).astype(np.int64),
+                                 minlength=len(self.hist))[:len(self.hist)]
+        bp_bin, logp_bin = PvalueBinner.MANH_BP_BIN, PvalueBinner.MANH_LOGP_BIN
+        bulk = pd.DataFrame({'CHR': chrom[~in_tail],
+                             'BP': (bp[~in_tail] // bp_bin) * bp_bin,
+                             'LOGP': np.round(logp[~in_tail] / logp_bin) * logp_bin})
+        self.grid.append(bulk.drop_duplicates())
+
+    # chromosomes are sorted as they may appear in any order, e.g. CHR=1, CHR=10, ..., CHR=2 partitions of
+    # .parquet / .feather datasets are read in string order
+    def finalize(self):
+        self.chromosomes = dict(sorted(self.chromosomes.items(), key=lambda item: natural_sort_key(item[0])))
+        self.tail = pd.concat(self.tail).sort_values('LOGP').reset_index(drop=True)
+        self.grid = pd.concat(self.grid).drop_duplicates().reset_index(drop=True)
+        self.n = int(np.sum(self.hist) + len(self.tail))
+
+    # number of variants with -log10(P) >= y, for each y
+    def count_above(self, y):
+        hist_above = np.concatenate([np.cumsum(self.hist[::-1])[::-1], [0]])
+        bins = np.minimum(np.ceil(y / PvalueBinner.LOGP_RESOLUTION).astype(np.int64), len(self.hist))
+        tail_above = len(self.tail) - np.searchsorted(self.tail['LOGP'].values, y, side='left')
+        return np.where(y >= self.tail_logp, 0, hist_above[bins]) + tail_above
+
+    # QQ curve: for a grid of observed -log10(P) values (y), expected -log10(P) at the same rank (x),
+    # and 95% confidence interval of the expected order statistics; grid points without any variant at or above
+    # them (e.g. y=tail_logp if no variant reaches --tail-p) are dropped, as their expected -log10(P) is infinite
+    def qq_data(self, title, num_points=200):
+        max_logp = self.tail['LOGP'].values[-1] if len(self.tail) else self.tail_logp
+        y = np.linspace(0, max_logp, num_points)
+        count = self.count_above(y)
+        y = y[count > 0]
+        x = -np.log10(count[count > 0] / self.n)
+
+        rank = np.unique(np.round(np.logspace(0, np.log10(self.n), num_points)).astype(np.int64))
+        x_ci = -np.log10(rank / self.n)
+        lower_ci = -np.log10(stats.beta.ppf(0.975, rank, self.n - rank + 1))
+        upper_ci = -np.log10(stats.beta.ppf(0.025, rank, self.n - rank + 1))
+        return {'x_ci': x_ci[::-1], 'lower_ci': lower_ci[::-1], 'upper_ci': upper_ci[::-1], 'x': x, 'y': y,
+                'title': title}
+
+def read_sumstats_columns(fname, columns, chunksize):
+    if os.path.isdir(fname):
+        import pyarrow.dataset
+        dataset = pyarrow.dataset.dataset(fname, format=('ipc' if fname.endswith('.feather') else 'parquet'),
+                                          partitioning='hive')
+        for batch in dataset.to_batches(columns=columns, batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(fname, sep='\t', usecols=columns, chunksize=chunksize)
+
+def make_figures(args, log):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    if os.path.isfile(args.sumstats) or os.path.isdir(args.sumstats):
+        log.log('reading {}...'.format(args.sumstats))
+    else:
+        raise ValueError("Input file does not exist: {f}".format(f=args.sumstats))
+    binner = PvalueBinner(args.tail_p)
+    for df in read_sumstats_columns(args.sumstats, ['CHR', 'BP', 'P'], args.chunksize):
+        binner.add(df['CHR'].astype(str).values, df['BP'].values, df['P'].values.astype(np.float64))
+    binner.finalize()
+    log.log('done, n={} variants, n={} with P<{}, n={} bins for the remaining variants'.format(
+        binner.n, len(binner.tail), args.tail_p, len(binner.grid)))
+    if binner.n == 0:
+        raise ValueError('no valid p-values found in {}'.format(args.sumstats))
+
+    qq = binner.qq_data(args.title)
+    with open(args.out + '.qq.png.json', 'w') as f:
+        json.dump(qq, f, cls=NumpyEncoder)
+    plt.figure(figsize=(6, 6))
+    plt.fill_between(qq['x_ci'], qq['lower_ci'], qq['upper_ci'], color='0.85')
+    plt.plot(qq['x'], qq['y'], '.-')
+    plt.plot([0, qq['x_ci'][-1]], [0, qq['x_ci'][-1]], 'k--')
+    plt.xlabel('Expected -log10(P)')
+    plt.ylabel('Observed -log10(P)')
+    plt.title(args.title)
+    plt.savefig(args.out + '.qq.png', dpi=100, bbox_inches='tight')
+    plt.close()
+
+    offsets = dict(zip(binner.chromosomes, np.cumsum([0] + list(binner.chromosomes.values())[:-1])))
+    plt.figure(figsize=(12, 5))
+    for index, chri in enumerate(binner.chromosomes):
+        color = ['#1f3b73', '#7f9cc9'][index % 2]
+        for df in [binner.grid, binner.tail]:
+            df = df[df['CHR'] == chri]
+            plt.plot(df['BP'].values + offsets[chri], df['LOGP'].values, '.', color=color, markersize=3)
+    plt.axhline(-np.log10(1e-5), color='b', linewidth=0.8)
+    plt.axhline(-np.log10(5e-8), color='r', linewidth=0.8)
+    plt.xticks([offsets[chri] + binner.chromosomes[chri] / 2 for chri in binner.chromosomes],
+               list(binner.chromosomes))
+    plt.xlim(0, sum(binner.chromosomes.values()))
+    plt.ylim(bottom=0)
+    plt.xlabel('Chromosome')
+    plt.ylabel('-log10(P)')
+    plt.title(args.title)
+    plt.savefig(args.out + '.manh.png', dpi=100, bbox_inches='tight')
+    plt.close()
+    log.log('{out}.qq.png, {out}.qq.png.json and {out}.manh.png written'.format(out=args.out))
 
 def check_input_file(fname, chr2use=None):
     if (chr2use is not None) and ('@' in fname):
@@ -950,32 +2148,297 @@ def read_fam(args, fam_file):
         raise ValueError("IID column has duplicated values in --fam file")
     return fam
 
-# Intput:
-#   args - command line arguments (as usual)
-#   commands - array of commands to put in a SLURM job
-#   array_spec - list of SLURM_ARRAY_TASK_ID if job array, otherwise None
-# Output:
-#   slurm_job_file - filename of a .job file to output commands (with SLURM header)
-#   cmd_file - file that concatenate all commands (in case user wants to execute everything by a BASH on a local node)
-#   submit_job_list - instructions for a user about how to schedule SLURM jobs
-def append_job(args, commands, array_spec, slurm_job_index, cmd_file, submit_jobs_list):
-    slurm_job_file = args.out + '.{}.job'.format(slurm_job_index)
-    with open(slurm_job_file, 'w') as f:
-        f.write(make_slurm_header(args, array_spec=array_spec) + '\n'.join(commands) + '\n')
-
-    with open(cmd_file, 'a') as f:
-        for command in commands:
-            if array_spec is not None:
-                f.write('for SLURM_ARRAY_TASK_ID in {}; do {}; done\n'.format(' '.join(array_spec), command))
-            else:
-                f.write('{}\n'.format(command))
 
-    if (slurm_job_index != 1):
-        submit_jobs_list.append('RES=$(sbatch --dependency=afterok:${{RES##* }} {})'.format(slurm_job_file))
-    else:
-        submit_jobs_list.append('RES=$(sbatch {})'.format(slurm_job_file))
+# input files up to this size are fingerprinted by their content, see file_signature
+FINGERPRINT_CONTENT_SIZE = 256 * 1024 ** 2
+
+# files that plink2, regenie and PRSice read along with --geno-file
+def geno_companion_files(fname):
+    if is_bed_file(fname):
+        return [replace_suffix(fname, '.bed', suffix) for suffix in ['.bim', '.fam']]
+    if is_pgen_file(fname):
+        return [replace_suffix(fname, '.pgen', suffix) for suffix in ['.pvar', '.psam']]
+    if is_bgen_file(fname):
+        return [replace_suffix(fname, '.bgen', '.sample'), fname + '.bgi']
+    return []
+
+# sha256 of the content of a file; the same files (and their companions) are signed for every job and chromosome,
+# so hashes are memoized by path, size and modification time, and a file is read at most once per run unless it
+# changes
+@functools.lru_cache(maxsize=None)
+def file_content_hash(path, size, mtime_ns):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 ** 2), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+# signature of an input file that is not produced by a job: sha256 of the content for files up to
+# FINGERPRINT_CONTENT_SIZE bytes (.pheno, .covar, --extract lists, etc), so that identical files match regardless
+# of their names and modification times; path, size and modification time for larger files (genotypes).
+# '@' expands to chr2use.
+def file_signature(fname, chr2use):
+    signature = []
+    fnames = [fname.replace('@', chri) for chri in chr2use] if ('@' in fname) else [fname]
+    for path in fnames + [companion for name in fnames for companion in geno_companion_files(name)]:
+        if not os.path.exists(path):
+            signature.append([path, None])
+            continue
+        stat = os.stat(path)
+        if stat.st_size > FINGERPRINT_CONTENT_SIZE:
+            signature.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+            continue
+        signature.append(file_content_hash(os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+    return signature
+
+
+# runs a command (argv[2:]) and writes resource usage of all its descendant processes as JSON to file descriptor
+# argv[1], see JobGraph.run_local: user/system CPU time and block I/O are summed over the descendants, while
+# max_rss_mb is the peak RSS of the largest single descendant (ru_maxrss of RUSAGE_CHILDREN), not of the process tree
+# as a whole; tasks are started from this small process rather than directly from gwas.py, as a child inherits the
+# peak RSS of its parent at the time of fork, which would otherwise be reported as max_rss_mb of each task.
+# pgs.py of pgs_toolkit runs its statements with a copy of this code (_TRACE_WRAPPER)
+TASK_WRAPPER = '''import json, os, resource, subprocess, sys
+code = subprocess.call(sys.argv[2:])
+usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+os.write(int(sys.argv[1]), json.dumps({
+    'user_time': round(usage.ru_utime, 3), 'system_time': round(usage.ru_stime, 3),
+    'max_rss_mb': round(usage.ru_maxrss / 1024, 1),
+    'read_bytes': usage.ru_inblock * 512, 'write_bytes': usage.ru_oublock * 512}).encode())
+sys.exit(128 - code if (code < 0) else code)
+'''
+
+
+class JobGraph(object):
+    '''
+    SLURM jobs with dependencies derived from files that each job reads (inputs) and writes (outputs):
+    a job depends on all previously added jobs that produce any of its inputs, so independent steps
+    (e.g. regenie step1 and plink2 --freq/--hardy/--missing) run concurrently instead of in a linear chain.
+    File names may contain '@' as a chromosome placeholder; they are matched as strings.
+
+    Each job has a fingerprint of its commands, --config (except slurm section) and inputs, where inputs produced
+    by other jobs contribute fingerprints of these jobs. A task that succeeds records the fingerprint in a stamp
+    file, and is skipped on subsequent runs while the stamp matches, is newer than stamps of the jobs it depends on,
+    and its outputs exist; outputs with '@' are not checked, as with --shard-variants tasks don't correspond to
+    chromosomes.
+    '''
 
-    return slurm_job_index
+    def __init__(self, args):
+        self.args = args
+        self.jobs = []
+        self.config = {key: value for key, value in args.config_object.items() if key != 'slurm'}
+
+    # commands - array of commands to put in a SLURM job
+    # array_spec - list of SLURM_ARRAY_TASK_ID if job array, otherwise None
+    def add(self, name, commands, array_spec=None, inputs=(), outputs=()):
+        if name in [job['name'] for job in self.jobs]:
+            raise ValueError('job {} is already defined'.format(name))
+        producers = {output: job for job in self.jobs for output in job['outputs']}
+        after, signatures, upstream_stamps = [], [], []
+        for fname in inputs:
+            if fname in producers:
+                signatures.append([fname, producers[fname]['fingerprint']])
+                if producers[fname]['name'] not in after:
+                    after.append(producers[fname]['name'])
+                    upstream_stamps.extend([self.stamp_file(producers[fname], task_id)
+                                            for task_id in (producers[fname]['array_spec'] or [None])])
+            else:
+                signatures.append(file_signature(fname, self.args.chr2use))
+        fingerprint = hashlib.sha256(json.dumps(
+            [__version__, name, commands, self.config, signatures], default=str).encode()).hexdigest()
+        self.jobs.append({'name': name, 'commands': commands, 'array_spec': array_spec,
+                          'inputs': list(inputs), 'outputs': list(outputs), 'after': after,
+                          'index': len(self.jobs) + 1, 'fingerprint': fingerprint,
+                          'upstream_stamps': upstream_stamps})
+
+    def stamp_file(self, job, task_id):
+        return self.args.out + '.{}{}.done'.format(job['name'], '' if (task_id is None) else '.' + task_id)
+
+    def is_up_to_date(self, job, task_id):
+        stamp_file = self.stamp_file(job, task_id)
+        if not os.path.exists(stamp_file):
+            return False
+        with open(stamp_file) as f:
+            if f.read().strip() != job['fingerprint']:
+                return False
+        mtime = os.path.getmtime(stamp_file)
+        if any(os.path.exists(fname) and (os.path.getmtime(fname) > mtime) for fname in job['upstream_stamps']):
+            return False
+        return all(os.path.exists(fname) for fname in job['outputs'] if ('@' not in fname))
+
+    # drop up-to-date jobs and tasks of job arrays, keeping only missing or stale ones; all tasks of a job are stale
+    # if any job it depends on is kept
+    def resume(self, log):
+        for job in list(self.jobs):
+            tasks = job['array_spec'] or [None]
+            kept = [other['name'] for other in self.jobs]
+            if any(name in kept for name in job['after']):
+                stale = tasks
+            else:
+                stale = [task_id for task_id in tasks if not self.is_up_to_date(job, task_id)]
+            if not stale:
+                log.log('job {} is up to date'.format(job['name']))
+                self.jobs.remove(job)
+            elif job['array_spec'] is not None:
+                log.log('job {}: {} of {} tasks are missing or stale'.format(job['name'], len(stale), len(tasks)))
+                job['array_spec'] = stale
+            else:
+                log.log('job {} is missing or stale'.format(job['name']))
+        names = [job['name'] for job in self.jobs]
+        for job in self.jobs:
+            job['after'] = [name for name in job['after'] if name in names]
+
+    # total size of existing files; '@' is replaced with the task ID of job array tasks, and expands to chr2use
+    # otherwise (see file_signature); files with '@' are not counted with --shard-variants (see is_up_to_date)
+    def files_size(self, fnames, task_id):
+        paths = []
+        for fname in fnames:
+            if '@' not in fname:
+                paths.append(fname)
+            elif not vars(self.args).get('shard_variants'):
+                paths.extend([fname.replace('@', chri) for chri in ([task_id] if task_id else self.args.chr2use)])
+        return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+    # resource usage of a task: wall time, usage of its processes reported by TASK_WRAPPER (None if the wrapper
+    # was killed), and total size of the task's input and output files
+    def trace_record(self, job, task_id, label, start_time, usage, exit_code):
+        record = {'step': label, 'job': job['name'], 'task': task_id, 'start': time.ctime(start_time),
+                  'wall_time': round(time.time() - start_time, 3)}
+        for key in ['user_time', 'system_time', 'max_rss_mb', 'read_bytes', 'write_bytes']:
+            record[key] = usage.get(key)
+        record.update({'input_bytes': self.files_size(job['inputs'], task_id),
+                       'output_bytes': self.files_size(job['outputs'], task_id),
+                       'exit_code': exit_code})
+        return record
+
+    # BASH script of a single task: skipped if up to date (see is_up_to_date); otherwise commands run in a subshell
+    # with 'set -e', and the stamp file is written only if all of them succeed
+    def task_script(self, job):
+        stamp_file = self.stamp_file(job, None if (job['array_spec'] is None) else '${SLURM_ARRAY_TASK_ID}')
+        checks = ['[ "$(cat {} 2>/dev/null)" == "{}" ]'.format(stamp_file, job['fingerprint'])] + \
+            ['[ ! {} -nt {} ]'.format(fname, stamp_file) for fname in job['upstream_stamps']] + \
+            ['[ -e {} ]'.format(fname) for fname in job['outputs'] if ('@' not in fname)]
+        return ('if {checks}; then\n'
+                'echo "{name} is up to date, remove {stamp_file} to run it again"\n'
+                'else\n'
+                'rm -f {stamp_file}\n'
+                '(\nset -e\n{commands}\n)\n'
+                '[ $? -eq 0 ] && echo {fingerprint} > {stamp_file}\n'
+                'fi\n').format(checks=' && '.join(checks), name=job['name'], stamp_file=stamp_file,
+                               commands='\n'.join(job['commands']), fingerprint=job['fingerprint'])
+
+    # Output:
+    #   <out>.<index>.job - one file per job, with SLURM header
+    #   cmd_file - file that concatenate all commands (in case user wants to execute everything by a BASH on a local
+    #              node), in the order of job dependencies
+    #   submit_file - instructions for a user about how to schedule SLURM jobs; also returned as a list of lines
+    def write(self, cmd_file, submit_file):
+        submit_jobs = []
+        with open(cmd_file, 'w') as f:
+            for job in self.jobs:
+                job['job_file'] = self.args.out + '.{}.job'.format(job['index'])
+                with open(job['job_file'], 'w') as job_f:
+                    job_f.write(make_slurm_header(self.args, array_spec=job['array_spec']) + self.task_script(job))
+
+                if job['array_spec'] is not None:
+                    f.write('for SLURM_ARRAY_TASK_ID in {}; do\n{}done\n'.format(
+                        ' '.join(job['array_spec']), self.task_script(job)))
+                else:
+                    f.write(self.task_script(job))
+
+                dependency = ':'.join(['${{RES_{}##* }}'.format(name) for name in job['after']])
+                submit_jobs.append('RES_{}=$(sbatch {}{})'.format(
+                    job['name'], '--dependency=afterok:{} '.format(dependency) if dependency else '', job['job_file']))
+
+        with open(submit_file, 'w') as f:
+            f.write('#!/bin/bash\n' + '\n'.join(submit_jobs) + '\n')
+        return submit_jobs
+
+    # run all jobs on the current machine (after write); each job array is split into one task per
+    # SLURM_ARRAY_TASK_ID, and each task reserves the same resources as a SLURM job would, so that the number of
+    # concurrent tasks is limited by --jobs, --local-cpus and --local-mem. A task starts once all jobs it depends
+    # on are complete; no new tasks are started after a failure. Output of each task goes to <job file>.<task>.out,
+    # and its resource usage (see trace_record) to <out>.trace.jsonl, one JSON record per line
+    def run_local(self, log):
+        args, slurm = self.args, self.args.config_object['slurm']
+        local_mem = args.local_mem * 1024 if args.local_mem else \
+            os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 2
+        task_cpus = int(slurm['cpus_per_task'])
+        task_mem = parse_slurm_mem(slurm['mem_per_cpu']) * task_cpus
+        max_tasks = max(1, min(args.local_cpus // task_cpus, int(local_mem // task_mem)))
+        if (task_cpus > args.local_cpus) or (task_mem > local_mem):
+            log.log('WARNING: a task requires {} CPUs and {:.1f} GB (slurm.cpus_per_task and slurm.mem_per_cpu in '
+                    '--config), more than --local-cpus {} / --local-mem {:.1f} GB; running one task at a time'.format(
+                        task_cpus, task_mem / 1024, args.local_cpus, local_mem / 1024))
+        if args.jobs and (args.jobs > max_tasks):
+            log.log('WARNING: --jobs {} is reduced to {} concurrent tasks, as each task takes slurm.cpus_per_task={} '
+                    'CPUs and {:.1f} GB of --local-cpus {} / --local-mem {:.1f} GB; lower slurm.cpus_per_task in '
+                    '--config or raise --local-cpus / --local-mem to run more tasks'.format(
+                        args.jobs, max_tasks, task_cpus, task_mem / 1024, args.local_cpus, local_mem / 1024))
+        if args.jobs:
+            max_tasks = min(max_tasks, args.jobs)
+        log.log('running jobs locally, up to {} concurrent tasks ({} CPUs and {:.1f} GB per task)'.format(
+            max_tasks, task_cpus, task_mem / 1024))
+
+        header = make_local_header(args)
+        trace_file, trace = args.out + '.trace.jsonl', []
+        open(trace_file, 'w').close()
+        pending = [(job, task_id) for job in self.jobs for task_id in (job['array_spec'] or [None])]
+        remaining = {job['name']: len(job['array_spec'] or [None]) for job in self.jobs}
+        running, failed = {}, []
+        while (pending and not failed) or running:
+            for job, task_id in list(pending):
+                if failed or (len(running) >= max_tasks):
+                    break
+                if any(remaining[name] for name in job['after']):
+                    continue
+                env = dict(os.environ)
+                env.pop('SLURM_ARRAY_TASK_ID', None)
+                if task_id is not None:
+                    env['SLURM_ARRAY_TASK_ID'] = task_id
+                label = job['name'] + ('[{}]'.format(task_id) if (task_id is not None) else '')
+                out_file = job['job_file'] + ('.{}'.format(task_id) if (task_id is not None) else '') + '.out'
+                read_fd, write_fd = os.pipe()
+                with open(out_file, 'w') as f:
+                    process = subprocess.Popen(
+                        [sys.executable, '-c', TASK_WRAPPER, str(write_fd), 'bash', '-e', '-c',
+                         header + self.task_script(job)],
+                        env=env, stdout=f, stderr=subprocess.STDOUT, pass_fds=[write_fd])
+                os.close(write_fd)
+                running[process] = (job, task_id, label, out_file, time.time(), read_fd)
+                pending.remove((job, task_id))
+                log.log('task {} started'.format(label))
+
+            time.sleep(0.2)
+            for process in [process for process in running if (process.poll() is not None)]:
+                job, task_id, label, out_file, start_time, read_fd = running.pop(process)
+                with os.fdopen(read_fd) as f:
+                    usage = json.loads(f.read() or '{}')
+                trace.append(self.trace_record(job, task_id, label, start_time, usage, process.returncode))
+                with open(trace_file, 'a') as f:
+                    f.write(json.dumps(trace[-1]) + '\n')
+                if process.returncode != 0:
+                    failed.append(label)
+                    log.log('task {} failed with exit code {}, see {}'.format(label, process.returncode, out_file))
+                else:
+                    remaining[job['name']] -= 1
+                    log.log('task {} done in {}'.format(label, sec_to_str(round(time.time() - start_time, 2))))
+
+        if trace:
+            log.log('resource usage of each task is saved to {}; slowest tasks:\n{}'.format(
+                trace_file, format_trace_summary(trace)))
+        if failed:
+            raise ValueError('{} task(s) failed: {}; {} task(s) not started'.format(
+                len(failed), ', '.join(failed), len(pending)))
+
+# table of the slowest tasks of a trace (see JobGraph.trace_record), with sizes in MB; pgs.summarize_trace of
+# pgs_toolkit makes the same table from its trace file
+def format_trace_summary(trace, num_tasks=10):
+    df = pd.DataFrame(trace).sort_values('wall_time', ascending=False, kind='stable').head(num_tasks)
+    for column in ['input', 'output']:
+        df[column + '_mb'] = df[column + '_bytes'] / 1024 ** 2
+    columns = ['step', 'wall_time', 'user_time', 'system_time', 'max_rss_mb', 'input_mb', 'output_mb', 'exit_code']
+    return df[columns].to_string(index=False, float_format='{:.1f}'.format)
 
 def rename_iid_column(log, pheno_dict, pheno):
     if np.sum(pheno_dict['TYPE'] == 'IID') != 1:
@@ -991,13 +2454,65 @@ def rename_iid_column(log, pheno_dict, pheno):
     pheno.rename(columns={iid_column_name: 'IID'}, inplace=True)
     pheno_dict.loc[pheno_dict['FIELD'] == iid_column_name, 'FIELD'] = 'IID'
 
-def read_comorment_pheno(args, pheno_file, dict_file):
-    log.log('reading {}...'.format(pheno_file))
-    pheno = pd.read_csv(pheno_file, sep=args.pheno_sep, dtype=str)
-    log.log('done, {} rows, {} cols'.format(len(pheno), pheno.shape[1]))
-    if args.log_sensitive:
-        log.log(pheno.head())
+def pheno_dtype(columns, pheno_dict_map):
+    return {c: (float if (pheno_dict_map[c] == 'CONTINUOUS') else str) for c in columns}
+
+
+# --pheno-cache file name is a hash of --pheno-file and --dict-file paths, sizes and modification times,
+# and delimiters used to parse them; any change of the input files invalidates the cache
+PHENO_CACHE_VERSION = 1
+
+
+def pheno_cache_file(args, pheno_file, dict_file):
+    key = [PHENO_CACHE_VERSION, args.pheno_sep, args.dict_sep]
+    for fname in [pheno_file, dict_file]:
+        stat = os.stat(fname)
+        key += [os.path.abspath(fname), stat.st_size, stat.st_mtime_ns]
+    return os.path.join(args.pheno_cache, hashlib.sha256(json.dumps(key).encode()).hexdigest() + '.parquet')
+
+# return --pheno-cache file for --pheno-file, creating it if needed; all columns are converted in chunks and written
+# as parquet row groups, with CONTINUOUS columns stored as float64 and the remaining columns stored as strings
+def make_pheno_cache(args, pheno_file, dict_file, pheno_dict_map, chunksize=100000):
+    import pyarrow
+    import pyarrow.parquet
+
+    cache_file = pheno_cache_file(args, pheno_file, dict_file)
+    if os.path.exists(cache_file):
+        os.utime(cache_file)  # mark as recently used
+        return cache_file
+
+    log.log('converting {} to {}...'.format(pheno_file, cache_file))
+    os.makedirs(args.pheno_cache, exist_ok=True)
+    header = pd.read_csv(pheno_file, sep=args.pheno_sep, nrows=0).columns
+    dtype = pheno_dtype(header, pheno_dict_map)
+    schema = pyarrow.schema([(c, pyarrow.float64() if (dtype[c] is float) else pyarrow.string()) for c in header])
+    tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    with pyarrow.parquet.ParquetWriter(tmp_file, schema) as writer:
+        for chunk in pd.read_csv(pheno_file, sep=args.pheno_sep, dtype=dtype, float_precision='round_trip',
+                                 chunksize=chunksize):
+            writer.write_table(pyarrow.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    os.replace(tmp_file, cache_file)  # atomic, in case several runs populate the cache at the same time
+    log.log('done, {:.1f} MB'.format(os.path.getsize(cache_file) / 1024 ** 2))
+
+    evict_pheno_cache(args, keep=cache_file)
+    return cache_file
+
+# remove least recently used files until --pheno-cache folder fits into --pheno-cache-size
+def evict_pheno_cache(args, keep):
+    files = [os.path.join(args.pheno_cache, f) for f in os.listdir(args.pheno_cache) if f.endswith('.parquet')]
+    files = sorted(files, key=lambda f: os.path.getmtime(f), reverse=True)
+    total_size, max_size = 0, args.pheno_cache_size * 1024 ** 3
+    for fname in files:
+        size = os.path.getsize(fname)
+        if (total_size + size > max_size) and (fname != keep):
+            log.log('removing {} from --pheno-cache'.format(fname))
+            os.remove(fname)
+        else:
+            total_size += size
 
+# read --pheno-file and --dict-file; if 'columns' is specified, only these columns are loaded from --pheno-file
+# (in addition to IID and FID), parsed according to their TYPE in --dict-file; otherwise all columns are loaded
+def read_comorment_pheno(args, pheno_file, dict_file, columns=None):
     log.log('reading {}...'.format(dict_file))
     pheno_dict = pd.read_csv(dict_file, sep=args.dict_sep)
     log.log('done, {} rows, {} cols, header:'.format(len(pheno_dict), pheno_dict.shape[1]))
@@ -1016,12 +2531,33 @@ def read_comorment_pheno(args, pheno_file, dict_file):
         raise ValueError("TYPE column in --dict can only have IID, CONTINUOUS, BINARY and NOMINAL - "
                          "found other values, e.g. {}".format(extra_values[0]))
 
+    header = pd.read_csv(pheno_file, sep=args.pheno_sep, nrows=0).columns
+    missing_cols = [str(c) for c in header if (c not in pheno_dict['FIELD'].values)]
+    if missing_cols:
+        raise ValueError('--pheno-file columns not present in --dict: {}'.format(', '.join(missing_cols)))
+
+    pheno_dict_map = dict(zip(pheno_dict['FIELD'], pheno_dict['TYPE']))
+    if columns is not None:
+        iid_columns = [c for c in header if (pheno_dict_map[c] == 'IID') or (c in ['IID', 'FID'])]
+        usecols = set(iid_columns + list(columns))
+        header = [c for c in header if c in usecols]
+    dtype = pheno_dtype(header, pheno_dict_map)
+
+    if args.pheno_cache:
+        cache_file = make_pheno_cache(args, pheno_file, dict_file, pheno_dict_map)
+        log.log('reading {} (cached {})...'.format(cache_file, pheno_file))
+        import pyarrow.parquet
+        pheno = pyarrow.parquet.read_table(cache_file, columns=list(header)).to_pandas()
+    else:
+        log.log('reading {}...'.format(pheno_file))
+        pheno = pd.read_csv(pheno_file, sep=args.pheno_sep, usecols=header, dtype=dtype, float_precision='round_trip')
+    log.log('done, {} rows, {} cols'.format(len(pheno), pheno.shape[1]))
+    if args.log_sensitive:
+        log.log(pheno.head())
+
     rename_iid_column(log, pheno_dict, pheno)  # hack-hack
     if np.any(pheno['IID'].duplicated()):
         raise ValueError('IID column has duplicated values in --pheno-file')
-    missing_cols = [str(c) for c in pheno.columns if (c not in pheno_dict['FIELD'].values)]
-    if missing_cols:
-        raise ValueError('--pheno-file columns not present in --dict: {}'.format(', '.join(missing_cols)))
 
     pheno_dict_map = dict(zip(pheno_dict['FIELD'], pheno_dict['TYPE']))
     for c in pheno.columns:
@@ -1032,10 +2568,11 @@ def read_comorment_pheno(args, pheno_file, dict_file):
                     log.log(bad_format.head())
                 raise ValueError("BINARY column {} has values other than 0 or 1; see above for offending rows "
                                  "(if not shown, re-run with --log-sensitive argument)".format(c))
-        if pheno_dict_map[c] == 'CONTINUOUS':
-            pheno[c] = pheno[c].astype(float)
 
-    # filter phenotype file according to --keep and --remove
+    return pheno, pheno_dict
+
+# filter phenotype file according to --keep and --remove
+def apply_keep_and_remove(args, pheno):
     keep = set()
     remove = set()
     for fname in args.keep:
@@ -1055,7 +2592,7 @@ def read_comorment_pheno(args, pheno_file, dict_file):
         if len(pheno) == 0:
             raise ValueError('no individuals left after applying --keep file(s)')
 
-    return pheno, pheno_dict
+    return pheno
 
 
 if __name__ == "__main__":
@@ -1092,3 +2629,8 @@ if __name__ == "__main__":
         log.log('Analysis finished at {T}'.format(T=time.ctime()))
         time_elapsed = round(time.time() - start_time, 2)
         log.log('Total time elapsed: {T}'.format(T=sec_to_str(time_elapsed)))
+        usage = [resource.getrusage(who) for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]]
+        log.log('Total CPU time: {U} user, {S} system; peak memory: {M:.1f} MB'.format(
+            U=sec_to_str(round(sum(u.ru_utime for u in usage), 2)),
+            S=sec_to_str(round(sum(u.ru_stime for u in usage), 2)),
+            M=max(u.ru_maxrss for u in usage) / 1024))
@@ -20,8 +20,18 @@
 # SBayesS
 
 import abc
+import concurrent.futures
+import gzip
+import json
 import os
+import re
+import resource
+import shlex
+import signal
 import subprocess
+import sys
+import threading
+import time
 import pandas as pd
 import numpy as np
 
@@ -85,12 +95,352 @@ def convert_dict_to_str(d, key_prefix='--'):
     return cmd
 
 
-def run_call(call):
-    '''run subprocess call'''
+def _python_literal(value):
+    '''Python literal of value, with strings in double quotes'''
+    if isinstance(value, str):
+        return json.dumps(value)
+    if isinstance(value, (list, tuple)):
+        return '[' + ', '.join(_python_literal(v) for v in value) + ']'
+    return repr(value)
+
+
+class PythonCall(str):
+    '''
+    Call of a function of this module as a statement: the str value is
+    the shell form ``$PYTHON -c 'from pgs import pgs; pgs.<func>(...)'``,
+    used in bash and slurm job scripts, while ``run_call`` and
+    ``run_tasks`` call the function in-process, without starting a
+    container
+
+    Parameters
+    ----------
+    func: callable
+        function defined in this module
+    *args, **kwargs
+        arguments of ``func``; str, numbers, bool, None and lists of these
+    '''
+
+    def __new__(cls, func, *args, **kwargs):
+        arguments = [_python_literal(arg) for arg in args] + [
+            f'{key}={_python_literal(value)}' for key, value in kwargs.items()]
+        code = ('from pgs import pgs; ' +
+                f'pgs.{func.__name__}({", ".join(arguments)})')
+        self = super().__new__(cls, f'$PYTHON -c {shlex.quote(code)}')
+        self.func, self.args, self.kwargs = func, args, kwargs
+        return self
+
+    def __call__(self):
+        return self.func(*self.args, **self.kwargs)
+
+
+# JSON lines file written by run_call and run_tasks, see start_trace
+_trace = {'file': None, 'lock': threading.Lock()}
+
+# runs a command (argv[2:]) and writes its resource usage as JSON to file
+# descriptor argv[1]; a copy of TASK_WRAPPER of scripts/gwas/gwas.py,
+# see there for why statements are not started directly
+_TRACE_WRAPPER = '''import json, os, resource, subprocess, sys
+code = subprocess.call(sys.argv[2:])
+usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+os.write(int(sys.argv[1]), json.dumps({
+    'user_time': round(usage.ru_utime, 3),
+    'system_time': round(usage.ru_stime, 3),
+    'max_rss_mb': round(usage.ru_maxrss / 1024, 1),
+    'read_bytes': usage.ru_inblock * 512,
+    'write_bytes': usage.ru_oublock * 512}).encode())
+sys.exit(128 - code if (code < 0) else code)
+'''
+
+
+def start_trace(trace_file):
+    '''
+    Record resource usage of each statement executed by ``run_call`` and
+    ``run_tasks``: wall time, user/system CPU time and block I/O of all
+    processes started by the statement, peak RSS of the largest of these
+    processes, and total size of input and output files of the task it
+    belongs to. Records are written to
+    ``trace_file`` as one JSON object per line (see ``summarize_trace``).
+
+    Parameters
+    ----------
+    trace_file: str or None
+        path to the trace file, which is overwritten.
+        If None, recording is stopped
+    '''
+    with _trace['lock']:
+        _trace['file'] = trace_file
+        if trace_file is not None:
+            open(trace_file, 'w').close()
+
+
+def summarize_trace(trace_file, n=10):
+    '''
+    Parameters
+    ----------
+    trace_file: str
+        trace file written after ``start_trace``
+    n: int
+        number of statements to list. Default: 10
+
+    Returns
+    -------
+    str
+        table of the ``n`` slowest statements, with sizes in MB;
+        the table is empty if no statement has been recorded
+    '''
+    columns = ['step', 'call', 'wall_time', 'user_time', 'system_time',
+               'max_rss_mb', 'input_bytes', 'output_bytes', 'exit_code']
+    with open(trace_file) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    df = pd.DataFrame(records, columns=columns)
+    df = df.sort_values('wall_time', ascending=False, kind='stable').head(n)
+    for column in ['input', 'output']:
+        df[f'{column}_mb'] = df[f'{column}_bytes'].astype(float) / 1024 ** 2
+    df['call'] = df['call'].str.slice(0, 40)
+    columns = ['step', 'call', 'wall_time', 'user_time', 'system_time',
+               'max_rss_mb', 'input_mb', 'output_mb', 'exit_code']
+    return df[columns].to_string(index=False, float_format='{:.1f}'.format)
+
+
+def _files_size(fnames):
+    '''total size of existing files'''
+    return sum(os.path.getsize(fname) for fname in fnames
+               if os.path.isfile(fname))
+
+
+def _start_call(call, **kwargs):
+    '''start shell statement; with ``start_trace``, it runs under
+    ``_TRACE_WRAPPER``. Returns Popen object and the state needed by
+    ``_wait_call``'''
     print(f'\nevaluating: {call}\n')
-    proc = subprocess.run(call, shell=True, check=True)
-    assert proc.returncode == 0
-    return proc
+    if _trace['file'] is None:
+        return subprocess.Popen(call, shell=True, **kwargs), None
+    read_fd, write_fd = os.pipe()
+    proc = subprocess.Popen(
+        [sys.executable, '-c', _TRACE_WRAPPER, str(write_fd),
+         '/bin/sh', '-c', call],
+        pass_fds=[write_fd], **kwargs)
+    os.close(write_fd)
+    return proc, (read_fd, time.time())
+
+
+def _wait_call(proc, trace_state, call, task=None):
+    '''wait for statement started by ``_start_call``, appending its
+    resource usage to the trace file, and return its exit code'''
+    returncode = proc.wait()
+    if trace_state is None:
+        return returncode
+    read_fd, start_time = trace_state
+    with os.fdopen(read_fd) as f:
+        usage = json.loads(f.read() or '{}')
+    _write_trace(call, task, start_time, usage, returncode)
+    return returncode
+
+
+def _write_trace(call, task, start_time, usage, returncode):
+    '''append resource usage of a statement to the trace file'''
+    record = {
+        'step': None if task is None else task.name,
+        'call': call,
+        'start': time.ctime(start_time),
+        'wall_time': round(time.time() - start_time, 3)}
+    for key in ['user_time', 'system_time', 'max_rss_mb',
+                'read_bytes', 'write_bytes']:
+        record[key] = usage.get(key)
+    record['input_bytes'] = None if task is None else \
+        _files_size(task.inputs)
+    record['output_bytes'] = None if task is None else \
+        _files_size(task.outputs)
+    record['exit_code'] = returncode
+    with _trace['lock']:
+        if _trace['file'] is not None:
+            with open(_trace['file'], 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+
+def _run_python_call(call, task=None):
+    '''run PythonCall in the calling thread; its trace record has CPU time
+    and block I/O of the thread, but no peak RSS, and exit code 1 if the
+    function raises an exception'''
+    print(f'\nevaluating in-process: {call}\n')
+    start_time = time.time()
+    before = resource.getrusage(resource.RUSAGE_THREAD)
+    returncode = 1
+    try:
+        call()
+        returncode = 0
+    finally:
+        if _trace['file'] is not None:
+            after = resource.getrusage(resource.RUSAGE_THREAD)
+            usage = {
+                'user_time': round(after.ru_utime - before.ru_utime, 3),
+                'system_time': round(after.ru_stime - before.ru_stime, 3),
+                'read_bytes': (after.ru_inblock - before.ru_inblock) * 512,
+                'write_bytes': (after.ru_oublock - before.ru_oublock) * 512}
+            _write_trace(call, task, start_time, usage, returncode)
+
+
+def run_call(call):
+    '''run subprocess call, or PythonCall in-process'''
+    if isinstance(call, PythonCall):
+        _run_python_call(call)
+        return subprocess.CompletedProcess(str(call), 0)
+    returncode = _wait_call(*_start_call(call), call)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, call)
+    return subprocess.CompletedProcess(call, returncode)
+
+
+class Task(object):
+    '''
+    Command line statement(s) with declared input and output files,
+    executed by ``run_tasks``
+
+    Parameters
+    ----------
+    calls: str, list of str or callable
+        statement(s) run one after another, as by ``run_call``
+        (``PythonCall`` statements run in-process).
+        If callable (other than ``PythonCall``), it is called when the
+        task starts, and must return str or list of str; this allows
+        statements that are generated from outputs of other tasks
+        (e.g., ``PGS_Plink.get_str`` with mode='basic' reads the header
+        of the transformed sumstats file)
+    inputs: list of str
+        files read by the task
+    outputs: list of str
+        files written by the task
+    threads: int
+        number of CPU cores used by the task, i.e., the ``threads``
+        (plink), ``thread`` (prsice2) or ``cores`` (ldpred2) value
+        in config.yaml. Default: 1
+    name: str or None
+        task name used in messages. Default: first output file
+    '''
+
+    def __init__(self, calls, inputs=None, outputs=None, threads=1,
+                 name=None):
+        self.calls = calls
+        self.inputs = list(inputs or [])
+        self.outputs = list(outputs or [])
+        self.threads = int(threads)
+        self.name = name or (self.outputs[0] if self.outputs else None)
+
+    def get_calls(self):
+        '''
+        Returns
+        -------
+        list of str
+            non-empty statements of the task
+        '''
+        # PythonCall is both str and callable, and is a statement itself
+        calls = self.calls
+        if callable(calls) and not isinstance(calls, str):
+            calls = calls()
+        if isinstance(calls, str):
+            calls = [calls]
+        return [call for call in calls if call]
+
+    def depends_on(self, other):
+        '''
+        Returns
+        -------
+        bool
+            True if ``other`` writes any file read or written by this task,
+            or reads any file written by this task, i.e., if ``other``
+            must complete before this task starts when ``other`` precedes
+            it in a serial run
+        '''
+        return bool(set(other.outputs) & set(self.inputs + self.outputs) or
+                    set(other.inputs) & set(self.outputs))
+
+
+def _run_task(task, state):
+    '''run statements of task one after another; each process is kept in
+    ``state['procs']`` so that ``run_tasks`` can terminate it'''
+    for call in task.get_calls():
+        with state['lock']:
+            if state['stop']:
+                return
+            if not isinstance(call, PythonCall):
+                proc, trace_state = _start_call(call, start_new_session=True)
+                state['procs'].add(proc)
+        if isinstance(call, PythonCall):
+            _run_python_call(call, task)
+            continue
+        returncode = _wait_call(proc, trace_state, call, task)
+        with state['lock']:
+            state['procs'].discard(proc)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, call)
+
+
+def run_tasks(tasks, cores=None):
+    '''
+    Run tasks concurrently, respecting dependencies between them and
+    a budget of CPU cores.
+
+    A task depends on each preceding task in ``tasks`` that writes files
+    it reads or writes, or reads files it writes (see
+    ``Task.depends_on``), so that listing tasks in the order of a serial
+    run gives the same results. Tasks start in list order as soon as the
+    tasks they depend on are complete and enough cores are free
+    (tasks using more than ``cores`` cores run alone). After the first
+    failure, no new tasks start and running tasks are terminated.
+
+    Parameters
+    ----------
+    tasks: list of Task
+        tasks to run
+    cores: int or None
+        number of CPU cores available. Default: os.cpu_count()
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        for the first failed statement
+    '''
+    cores = cores or os.cpu_count() or 1
+    depends = [[j for j in range(i) if task.depends_on(tasks[j])]
+               for i, task in enumerate(tasks)]
+    pending = list(range(len(tasks)))
+    done, futures, errors = set(), {}, []
+    state = {'lock': threading.Lock(), 'stop': False, 'procs': set()}
+    free = cores
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, len(tasks))) as pool:
+        while (pending and not errors) or futures:
+            for i in ([] if errors else list(pending)):
+                threads = min(tasks[i].threads, cores)
+                if threads > free or not set(depends[i]) <= done:
+                    continue
+                print(f'\nstarting task {tasks[i].name or i} '
+                      f'({threads} of {free} free cores)\n')
+                futures[pool.submit(_run_task, tasks[i], state)] = i
+                pending.remove(i)
+                free -= threads
+
+            finished, _ = concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                i = futures.pop(future)
+                free += min(tasks[i].threads, cores)
+                if future.exception() is None:
+                    done.add(i)
+                    continue
+                errors.append(future.exception())
+                with state['lock']:
+                    state['stop'] = True
+                    for proc in state['procs']:
+                        try:
+                            # statements run in a shell, terminate its group
+                            os.killpg(proc.pid, signal.SIGTERM)
+                        except ProcessLookupError:
+                            pass
+    if errors:
+        if pending:
+            print(f'{len(pending)} task(s) not started due to failure')
+        raise errors[0]
 
 
 def post_run_plink(
@@ -150,45 +500,99 @@ def post_run_prsice2(output_dir, data_prefix, score_file='test.score'):
                   sep=' ', index=False)
 
 
+def _open_output(fname):
+    '''open text file for writing, gzip-compressed if it ends with .gz'''
+    if fname.endswith('.gz'):
+        return gzip.open(fname, 'wt')
+    return open(fname, 'w', encoding='utf-8')
+
+
 def df_colums_to_file(
         source_file,
         output_file,
         usecols=None,
         delim_whitespace=True,
         delimiter=None,
+        chunksize=1000000,
         **kwargs):
-    '''Extract columns from dataframe (.csv) on file to output_file
+    '''Extract columns from dataframe (.csv) on file to output_file(s)
+
+    The source file is read once, in chunks of ``chunksize`` rows, parsing
+    only the columns written to any of the output files. Values are copied
+    as text, without conversion to numbers. Gzip (and bgzip) compressed
+    source files are detected from their content, output files ending with
+    .gz are gzip-compressed.
 
     Parameters
     ----------
     source_file: file path
         .csv (or similar) input file read by pandas.read_csv.
-    output_file: file path
-        output file to be written
-    usecols: list of str or None
-        columns to read and write
+    output_file: file path or list of file paths
+        output file(s) to be written
+    usecols: list of str or None, or list of these
+        columns to read and write, in the order written (None for all
+        columns), or, if output_file is a list, one such entry for each
+        output file
     delim_whitespace: bool
-        parsed to df.read_csv. Default: True
+        if True, read columns separated by whitespace and write them
+        separated by a single space. Default: True
     delimiter: None or str
         delimiter. Default: None
+    chunksize: int
+        number of rows read at a time. Default: 1000000
     **kwargs
         keyword arguments parsed to pd.read_csv()
     '''
-    # read
-    df = pd.read_csv(
+    if isinstance(output_file, str):
+        output_files, columns = [output_file], [usecols]
+    else:
+        output_files = list(output_file)
+        columns = list(usecols) if usecols is not None else \
+            [None] * len(output_files)
+    # parse union of columns of all outputs
+    if any(cols is None for cols in columns):
+        parse_cols = None
+    else:
+        parse_cols = list(dict.fromkeys(c for cols in columns for c in cols))
+    with open(source_file, 'rb') as f:
+        is_gzip = f.read(2) == b'\x1f\x8b'
+    kwargs.setdefault('compression', 'gzip' if is_gzip else None)
+    kwargs.setdefault('dtype', str)
+    kwargs.setdefault('na_filter', False)
+
+    reader = pd.read_csv(
         source_file,
-        usecols=usecols,
-        delim_whitespace=delim_whitespace,
-        delimiter=delimiter,
+        usecols=parse_cols,
+        sep=r'\s+' if delim_whitespace else delimiter,
+        chunksize=chunksize,
         **kwargs)
-    # reorder
-    if usecols is not None:
-        df = df[usecols]
-    # write
-    df.to_csv(
-        output_file,
-        sep=' ' if delim_whitespace else delimiter,
-        index=False)
+    handles = [_open_output(fname) for fname in output_files]
+    try:
+        for i, df in enumerate(reader):
+            for f, cols in zip(handles, columns):
+                (df if cols is None else df[cols]).to_csv(
+                    f,
+                    sep=' ' if delim_whitespace else delimiter,
+                    index=False,
+                    header=(i == 0))
+    finally:
+        reader.close()
+        for f in handles:
+            f.close()
+
+
+# executables behind variables set by set_env: container in $SIF,
+# executable name, and whether the container is started with --cleanenv
+CONTAINER_TOOLS = {
+    'BASH': ('gwas.sif', 'bash', True),
+    'GUNZIP': ('gwas.sif', 'gunzip', True),
+    'GZIP': ('gwas.sif', 'gzip', True),
+    'AWK': ('gwas.sif', 'awk', True),
+    'RSCRIPT': ('r.sif', 'Rscript', True),
+    'PLINK': ('gwas.sif', 'plink', False),
+    'PRSICE': ('gwas.sif', 'PRSice_linux', True),
+    'PYTHON': ('python3.sif', 'python3', True),
+}
 
 
 def set_env(config):
@@ -201,9 +605,6 @@ def set_env(config):
     config: dict
         config dictionary from config.yaml (or similar file)
     '''
-    # present working dir
-    PWD = os.getcwd()
-
     ROOT_DIR = config['environ']['ROOT_DIR']
     os.environ.update({'ROOT_DIR': ROOT_DIR})
 
@@ -234,18 +635,87 @@ def set_env(config):
           os.environ['SINGULARITY_BIND'], '\n')
 
     # Executables in different containers
-    SIF = os.environ['SIF']
-    os.environ.update(
-        dict(
-            BASH=f"singularity exec --home={PWD}:/home --cleanenv {SIF}/gwas.sif bash",  # noqa: E501
-            GUNZIP=f"singularity exec --home={PWD}:/home --cleanenv {SIF}/gwas.sif gunzip",  # noqa: E501
-            GZIP=f"singularity exec --home={PWD}:/home --cleanenv {SIF}/gwas.sif gzip",  # noqa: E501
-            AWK=f"singularity exec --home={PWD}:/home --cleanenv {SIF}/gwas.sif awk",  # noqa: E501
-            RSCRIPT=f"singularity exec --home={PWD}:/home --cleanenv {SIF}/r.sif Rscript",  # noqa: E501
-            PLINK=f"singularity exec --home={PWD}:/home {SIF}/gwas.sif plink",  # noqa: E501
-            PRSICE=f"singularity exec --home={PWD}:/home --cleanenv {SIF}/gwas.sif PRSice_linux",  # noqa: E501
-            PYTHON=f"singularity exec --home={PWD}:/home --cleanenv {SIF}/python3.sif python3",  # noqa: E501
-        ))
+    os.environ.update({
+        key: f'{_singularity_exec(sif, cleanenv)} {executable}'
+        for key, (sif, executable, cleanenv) in CONTAINER_TOOLS.items()})
+
+
+def _singularity_exec(sif, cleanenv):
+    '''``singularity exec`` prefix for container ``sif`` in $SIF'''
+    return ' '.join(
+        ['singularity exec', f'--home={os.getcwd()}:/home'] +
+        (['--cleanenv'] if cleanenv else []) +
+        [os.path.join(os.environ['SIF'], sif)])
+
+
+def batch_calls(calls, script_prefix):
+    '''
+    Group consecutive statements that only use executables of the same
+    container (variables in ``CONTAINER_TOOLS``, e.g., ``$GUNZIP``,
+    ``$AWK`` and ``$GZIP`` in gwas.sif) into a single ``singularity exec``
+    invocation, which runs a generated step script with these variables
+    pointing to executables in the container. The script prints the exit
+    status of each step, and stops at the first failed step, exiting with
+    its status. The container is started with --cleanenv if all of its
+    grouped executables are. Statements that use other variables or
+    executables of several containers, ``PythonCall`` statements (run
+    in-process by ``run_call``), and groups of a single statement, are
+    returned unchanged. Requires ``set_env``
+
+    Parameters
+    ----------
+    calls: list of str
+        statements, as returned by ``get_str`` methods
+    script_prefix: str
+        path prefix of step scripts, written to
+        ``<script_prefix>.<n>.sh`` files
+
+    Returns
+    -------
+    list of str
+        statements with consecutive steps in the same container replaced by
+        a single statement
+    '''
+    groups = []  # [sif, list of calls, list of tool variables]
+    for call in calls:
+        keys = set(re.findall(r'\$\{?([A-Za-z_][A-Za-z0-9_]*)', call))
+        sifs = {CONTAINER_TOOLS[key][0] for key in keys
+                if key in CONTAINER_TOOLS}
+        sif = sifs.pop() if (len(sifs) == 1 and
+                             keys <= set(CONTAINER_TOOLS) and
+                             not isinstance(call, PythonCall)) else None
+        if sif is None or not groups or groups[-1][0] != sif:
+            groups.append([sif, [], set()])
+        groups[-1][1].append(call)
+        groups[-1][2].update(keys)
+
+    batched = []
+    for sif, group_calls, keys in groups:
+        if sif is None or len(group_calls) == 1:
+            batched += group_calls
+            continue
+        script_file = f'{script_prefix}.{len(batched) + 1}.sh'
+        lines = ['#!/bin/sh',
+                 f'# {len(group_calls)} steps in a single {sif} session, ' +
+                 'generated by pgs.batch_calls']
+        # shell variables, not exported: gzip reads options from $GZIP
+        tools = {key: executable for key, (tool_sif, executable, _)
+                 in CONTAINER_TOOLS.items() if tool_sif == sif}
+        lines += [f'unset {" ".join(tools)}']
+        lines += [f'{key}={executable}' for key, executable in tools.items()]
+        for i, call in enumerate(group_calls):
+            lines += [
+                '',
+                call,
+                'status=$?',
+                f'echo "step {i + 1} of {len(group_calls)} in {sif} ' +
+                'exited with status $status"',
+                '[ $status -eq 0 ] || exit $status']
+        with open(script_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        cleanenv = all(CONTAINER_TOOLS[key][2] for key in keys)
+        batched.append(f'{_singularity_exec(sif, cleanenv)} sh {script_file}')
+    return batched
 
 
 class BasePGS(abc.ABC):
@@ -555,24 +1025,22 @@ class PGS_Plink(BasePGS):
 
         Returns
         -------
-        str
+        list of PythonCall
         '''
-        command = ''
+        pvalue_file = os.path.join(self.output_dir,
+                                   self.clump_snp_field + '.pvalue')
+        pvalue_columns = [self.clump_snp_field, self.clump_field]
         if not update_effect_size:
             # unzip Sumstats file to output_dir allowing parsing
-            # it to Plink using --score
-            command += ' '.join([
-                '$PYTHON',
-                '-c',
-                f"""'from pgs import pgs; pgs.df_colums_to_file("{self.sumstats_file}", "{self._transformed_file}")'"""  # noqa: 501
-                '\n'
-            ])
-        command += ' '.join([
-            '$PYTHON',
-            '-c',
-            f"""'from pgs import pgs; pgs.df_colums_to_file("{self._transformed_file}", "{os.path.join(self.output_dir, self.clump_snp_field + ".pvalue")}", ["{self.clump_snp_field}", "{self.clump_field}"])'"""  # noqa: 501
-        ])
-        return command
+            # it to Plink using --score, and extract P-values from
+            # the same read
+            return [PythonCall(
+                df_colums_to_file, self.sumstats_file,
+                [self._transformed_file, pvalue_file],
+                [None, pvalue_columns])]
+        return [PythonCall(
+            df_colums_to_file, self._transformed_file, pvalue_file,
+            pvalue_columns)]
 
     def _write_range_list_file(self):
         '''
@@ -697,12 +1165,7 @@ class PGS_Plink(BasePGS):
         return command
 
     def _generate_post_run_str(self):
-        arg = ','.join([f'"{self.output_dir}"', f'"{self.data_prefix}"'])
-        cmd = ' '.join([
-            '$PYTHON', '-c',
-            f"""'from pgs.pgs import post_run_plink; post_run_plink({arg})'"""
-        ])
-        return cmd
+        return PythonCall(post_run_plink, self.output_dir, self.data_prefix)
 
     def get_model_evaluation_str(self):
         '''
@@ -758,7 +1221,7 @@ class PGS_Plink(BasePGS):
                     if update_effect_size else None),
                 self._preprocessing_clumping(update_effect_size),
                 self._preprocessing_extract_index_snp_id(),
-                self._preprocessing_extract_p_values(update_effect_size)]
+                *self._preprocessing_extract_p_values(update_effect_size)]
             return list(filter(lambda item: item is not None, commands))
         elif mode in ['basic', 'stratification']:
             self._write_range_list_file()
@@ -932,12 +1395,7 @@ class PGS_PRSice2(BasePGS):
         return command
 
     def _generate_post_run_str(self):
-        arg = ','.join([f'"{self.output_dir}"', f'"{self.data_prefix}"'])
-        cmd = ' '.join([
-            '$PYTHON', '-c',
-            f"""'from pgs.pgs import post_run_prsice2; post_run_prsice2({arg})'"""  # noqa: E501
-        ])
-        return cmd
+        return PythonCall(post_run_prsice2, self.output_dir, self.data_prefix)
 
     def get_model_evaluation_str(self):
         '''
@@ -1056,8 +1514,16 @@ class PGS_LDpred2(BasePGS):
         self._file_geno = self.geno_file_prefix + '.bed'
         self._file_out = os.path.join(self.output_dir, 'test.score')
 
-    def _run_create_backing_file(self):
-        # Convert plink files to bigSNPR backingfile(s) (.rds/.bk)
+    def get_create_backing_file_str(self):
+        '''
+        Return callable string for converting plink files to
+        bigSNPR backing file(s) (.rds/.bk) ``file_geno_rds``,
+        which may be shared by several ``PGS_LDpred2`` instances
+
+        Returns
+        -------
+        str
+        '''
         command = ' '.join([
             '$RSCRIPT',
             os.path.join('/ldpred2_scripts', 'createBackingFile.R'),
@@ -1153,7 +1619,7 @@ class PGS_LDpred2(BasePGS):
 
         # return calls
         if create_backing_file:
-            tmp_cmd0 = self._run_create_backing_file()
+            tmp_cmd0 = self.get_create_backing_file_str()
             return [tmp_cmd0, tmp_cmd1]
         else:
             return [tmp_cmd1]
@@ -145,6 +145,11 @@ parser.add_argument(
     default='subprocess',
     choices=runtype_choices
 )
+parser.add_argument(
+    '--batch-containers', action='store_true',
+    help="run consecutive commands that use the same container in a " +
+    "single container invocation (see pgs.batch_calls)"
+)
 
 # NameSpace object
 parsed_args, unknowns = parser.parse_known_args(sys.argv[1:])
@@ -158,7 +163,7 @@ assert len(unknowns) % 2 == 0, 'number of arguments must be even!'
 
 # convert to dict, remove skipped key/value pairs
 args_dict = vars(parsed_args).copy()
-for key in ['method', 'runtype']:
+for key in ['method', 'runtype', 'batch_containers']:
     args_dict.pop(key)
 
 
@@ -265,10 +270,23 @@ elif parsed_args.method in ['ldpred2-inf', 'ldpred2-auto']:
             nPCs=str(config['plink']['nPCs']),
             covariate_file=args_dict['covariate_file'])]
 
+# group commands by container, with step scripts in output_dir
+if parsed_args.batch_containers:
+    os.makedirs(parsed_args.output_dir, exist_ok=True)
+    commands = pgs.batch_calls(
+        commands,
+        os.path.join(parsed_args.output_dir, f'{parsed_args.method}-{now}'))
+
 # create tasks
 if parsed_args.runtype == 'subprocess':
+    trace_file = os.path.join(parsed_args.output_dir,
+                              f'{parsed_args.method}-{now}.trace.jsonl')
+    os.makedirs(parsed_args.output_dir, exist_ok=True)
+    pgs.start_trace(trace_file)
     for call in commands:
         pgs.run_call(call)
+    print(f'slowest statements (see {trace_file}):\n' +
+          pgs.summarize_trace(trace_file))
 
 elif parsed_args.runtype == 'sh':
     # write bash script
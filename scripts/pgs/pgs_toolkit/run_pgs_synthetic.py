@@ -34,6 +34,10 @@ if __name__ == '__main__':
     output_dir = 'output'
     os.makedirs(output_dir, exist_ok=True)
 
+    # resource usage of each executed statement
+    trace_file = os.path.join(output_dir, 'trace.jsonl')
+    pgs.start_trace(trace_file)
+
     # LDpred2 specific
     file_geno_rds = os.path.join(output_dir, 'g1000_eur_chr21to22_hm3rnd1.rds')
 
@@ -69,6 +73,11 @@ if __name__ == '__main__':
     data_prefix = os.path.split(geno_file_prefix)[-1]
     eigenvec_file = f'{os.path.join("{}", data_prefix)}.eigenvec'
 
+    # Steps below are collected as tasks with their input and output files,
+    # and executed by pgs.run_tasks once all of them are defined, so that
+    # independent PGS methods run concurrently.
+    tasks = []
+
     #######################################
     # Plink
     #######################################
@@ -86,23 +95,34 @@ if __name__ == '__main__':
         eigenvec_file=eigenvec_file.format(output_dir_plink),
         **config['plink'],
     )
-
-    # run preprocessing steps for plink
-    for call in plink.get_str(mode='preprocessing', update_effect_size=False):
-        if call is not None:
-            pgs.run_call(call)
-
-    # run basic plink PGS
-    for call in plink.get_str(mode='basic'):
-        pgs.run_call(call)
-
-    # run plink PGS with population stratification
-    for call in plink.get_str(mode='stratification'):
-        pgs.run_call(call)
+    valid_snp_file = os.path.join(
+        output_dir_plink, plink.data_prefix + '.valid.snp')
+    score_file = os.path.join(output_dir_plink, 'test.score')
+
+    # preprocessing steps for plink
+    tasks.append(pgs.Task(
+        plink.get_str(mode='preprocessing', update_effect_size=False),
+        inputs=[sumstats_file, geno_file_prefix + '.bed'],
+        outputs=[valid_snp_file, plink.eigenvec_file],
+        threads=config['plink']['threads'],
+        name='plink preprocessing'))
+
+    # basic plink PGS, and plink PGS with population stratification;
+    # commands are generated once preprocessing is done
+    for mode in ['basic', 'stratification']:
+        tasks.append(pgs.Task(
+            lambda mode=mode: plink.get_str(mode=mode),
+            inputs=[valid_snp_file, plink.eigenvec_file],
+            outputs=[score_file],
+            threads=config['plink']['threads'],
+            name=f'plink {mode}'))
 
     # post run model evaluation
-    call = plink.get_model_evaluation_str()
-    pgs.run_call(call)
+    tasks.append(pgs.Task(
+        plink.get_model_evaluation_str(),
+        inputs=[score_file],
+        outputs=[os.path.join(output_dir_plink, 'test_summary.txt')],
+        name='plink model evaluation'))
 
     #######################################
     # PRSice-2
@@ -122,13 +142,13 @@ if __name__ == '__main__':
         **config['prsice2'],
     )
 
-    # run commands
-    for call in prsice2.get_str():
-        pgs.run_call(call)
-
-    # post run model evaluation
-    call = prsice2.get_model_evaluation_str()
-    pgs.run_call(call)
+    # commands and post run model evaluation
+    tasks.append(pgs.Task(
+        prsice2.get_str() + [prsice2.get_model_evaluation_str()],
+        inputs=[sumstats_file, geno_file_prefix + '.bed'],
+        outputs=[os.path.join(output_dir_prsice2, 'test.score')],
+        threads=config['prsice2']['thread'],
+        name='prsice2'))
 
     ############################################
     # LDpred2 infinitesimal and automatic models
@@ -148,19 +168,29 @@ if __name__ == '__main__':
             file_geno_rds=file_geno_rds,
             **config['ldpred2']
         )
-        # run
-        for call in ldpred2.get_str(create_backing_file=True):
-            pgs.run_call(call)
-
-        # create .eigenvec and .cov files in ``output_dir``
-        # for post run model evaluation:
-        call = ldpred2.generate_eigenvec_eigenval_files(
-            nPCs=config['ldpred2']['nPCs'])
-        pgs.run_call(call)
-
-        # post run model evaluation
-        call = ldpred2.get_model_evaluation_str(
-            eigenvec_file=eigenvec_file.format(output_dir_ldpred2),
-            nPCs=config['ldpred2']['nPCs'],
-            covariate_file=covariate_file)
-        pgs.run_call(call)
+        # the backing file is shared by both methods, create it once
+        if method == 'inf':
+            tasks.append(pgs.Task(
+                ldpred2.get_create_backing_file_str(),
+                inputs=[geno_file_prefix + '.bed'],
+                outputs=[file_geno_rds],
+                name='LDpred2 backing file'))
+
+        # run, create .eigenvec and .cov files in ``output_dir``
+        # for post run model evaluation, and evaluate the model
+        tasks.append(pgs.Task(
+            ldpred2.get_str(create_backing_file=False) + [
+                ldpred2.generate_eigenvec_eigenval_files(
+                    nPCs=config['ldpred2']['nPCs']),
+                ldpred2.get_model_evaluation_str(
+                    eigenvec_file=eigenvec_file.format(output_dir_ldpred2),
+                    nPCs=config['ldpred2']['nPCs'],
+                    covariate_file=covariate_file)],
+            inputs=[sumstats_file, file_geno_rds],
+            outputs=[os.path.join(output_dir_ldpred2, 'test.score')],
+            threads=config['ldpred2']['cores'],
+            name=f'LDpred2 {method}'))
+
+    pgs.run_tasks(tasks)
+    print(f'slowest statements (see {trace_file}):\n' +
+          pgs.summarize_trace(trace_file))
@@ -34,6 +34,10 @@ if __name__ == '__main__':
     output_dir = 'output'
     os.makedirs(output_dir, exist_ok=True)
 
+    # resource usage of each executed statement
+    trace_file = os.path.join(output_dir, 'trace.jsonl')
+    pgs.start_trace(trace_file)
+
     # method specific input
     # Plink, PRSice2, LDpred2
     covariate_file = '/REF/examples/prsice2/EUR.cov'
@@ -84,9 +88,8 @@ if __name__ == '__main__':
         geno_file_prefix=geno_file_prefix,
         data_postfix=data_postfix,
         output_dir=QC_data,
+        threads=config['plink']['threads'],
     )
-    for call in qc.get_str():
-        pgs.run_call(call)
 
     # "Cleaned" geno_file_prefix from QC step
     geno_file_post_qc = os.path.join(
@@ -95,6 +98,18 @@ if __name__ == '__main__':
     # "Cleaned" summary statistics
     Sumstats_file_post_QC = os.path.join(QC_data, 'Height.QC.gz')
 
+    # Steps below are collected as tasks with their input and output files,
+    # and executed by pgs.run_tasks once all of them are defined: the PGS
+    # methods only depend on the QC step, and run concurrently.
+    # QC steps that use the same container run in a single container
+    # invocation.
+    tasks = [pgs.Task(
+        pgs.batch_calls(qc.get_str(), os.path.join(QC_data, 'QC')),
+        inputs=[sumstats_file, geno_file_prefix + '.bed'],
+        outputs=[Sumstats_file_post_QC, geno_file_post_qc + '.bed'],
+        threads=config['plink']['threads'],
+        name='QC')]
+
     #######################################
     # Plink
     #######################################
@@ -109,22 +124,34 @@ if __name__ == '__main__':
         eigenvec_file=eigenvec_file,
         **config['plink'],
     )
-
-    # run preprocessing steps for plink
-    for call in plink.get_str(mode='preprocessing', update_effect_size=True):
-        pgs.run_call(call)
-
-    # run basic plink PGS
-    for call in plink.get_str(mode='basic'):
-        pgs.run_call(call)
-
-    # run plink PGS with population stratification
-    for call in plink.get_str(mode='stratification'):
-        pgs.run_call(call)
+    valid_snp_file = os.path.join(
+        plink.output_dir, plink.data_prefix + '.valid.snp')
+    score_file = os.path.join(plink.output_dir, 'test.score')
+
+    # preprocessing steps for plink
+    tasks.append(pgs.Task(
+        plink.get_str(mode='preprocessing', update_effect_size=True),
+        inputs=[Sumstats_file_post_QC, geno_file_post_qc + '.bed'],
+        outputs=[valid_snp_file],
+        threads=config['plink']['threads'],
+        name='plink preprocessing'))
+
+    # basic plink PGS, and plink PGS with population stratification;
+    # commands are generated once preprocessing is done
+    for mode in ['basic', 'stratification']:
+        tasks.append(pgs.Task(
+            lambda mode=mode: plink.get_str(mode=mode),
+            inputs=[valid_snp_file],
+            outputs=[score_file],
+            threads=config['plink']['threads'],
+            name=f'plink {mode}'))
 
     # post run model evaluation
-    call = plink.get_model_evaluation_str()
-    pgs.run_call(call)
+    tasks.append(pgs.Task(
+        plink.get_model_evaluation_str(),
+        inputs=[score_file],
+        outputs=[os.path.join(plink.output_dir, 'test_summary.txt')],
+        name='plink model evaluation'))
 
     #######################################
     # PRSice-2
@@ -141,13 +168,13 @@ if __name__ == '__main__':
         **config['prsice2'],
     )
 
-    # run commands
-    for call in prsice2.get_str():
-        pgs.run_call(call)
-
-    # post run model evaluation
-    call = prsice2.get_model_evaluation_str()
-    pgs.run_call(call)
+    # commands and post run model evaluation
+    tasks.append(pgs.Task(
+        prsice2.get_str() + [prsice2.get_model_evaluation_str()],
+        inputs=[Sumstats_file_post_QC, geno_file_post_qc + '.bed'],
+        outputs=[os.path.join(prsice2.output_dir, 'test.score')],
+        threads=config['prsice2']['thread'],
+        name='prsice2'))
 
     ############################################
     # LDpred2 infinitesimal and automatic models
@@ -165,13 +192,26 @@ if __name__ == '__main__':
             file_geno_rds=file_geno_rds,
             **config['ldpred2']
         )
-        # run
-        for call in ldpred2.get_str(create_backing_file=True):
-            pgs.run_call(call)
-
-        # post run model evaluation
-        call = ldpred2.get_model_evaluation_str(
-            eigenvec_file=eigenvec_file,
-            nPCs=config['ldpred2']['nPCs'],
-            covariate_file=covariate_file)
-        pgs.run_call(call)
+        # the backing file is shared by both methods, create it once
+        if method == 'inf':
+            tasks.append(pgs.Task(
+                ldpred2.get_create_backing_file_str(),
+                inputs=[geno_file_post_qc + '.bed'],
+                outputs=[file_geno_rds],
+                name='LDpred2 backing file'))
+
+        # run, and post run model evaluation
+        tasks.append(pgs.Task(
+            ldpred2.get_str(create_backing_file=False) + [
+                ldpred2.get_model_evaluation_str(
+                    eigenvec_file=eigenvec_file,
+                    nPCs=config['ldpred2']['nPCs'],
+                    covariate_file=covariate_file)],
+            inputs=[Sumstats_file_post_QC, file_geno_rds],
+            outputs=[os.path.join(ldpred2.output_dir, 'test.score')],
+            threads=config['ldpred2']['cores'],
+            name=f'LDpred2 {method}'))
+
+    pgs.run_tasks(tasks)
+    print(f'slowest statements (see {trace_file}):\n' +
+          pgs.summarize_trace(trace_file))
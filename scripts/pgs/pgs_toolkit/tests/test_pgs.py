@@ -0,0 +1,208 @@
+# encoding: utf-8
+
+"""
+Test module for ``pgs.pgs``, using plain shell statements
+(no containers required)
+"""
+
+import gzip
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from pgs import pgs
+
+
+def _read_file(fname):
+    with open(fname) as f:
+        return f.read()
+
+
+def _read_lines(fname):
+    return _read_file(fname).split()
+
+
+def test_Task_depends_on(tmp_path):
+    """tasks depend on preceding tasks writing their inputs or outputs"""
+    a, b, c = [str(tmp_path / name) for name in 'abc']
+    writer = pgs.Task(f'echo A > {a}', outputs=[a])
+    reader = pgs.Task(f'cat {a} > {b}', inputs=[a], outputs=[b])
+    other = pgs.Task(f'echo C > {c}', outputs=[c])
+    overwriter = pgs.Task(f'echo D > {a}', outputs=[a])
+    assert reader.depends_on(writer)
+    assert not other.depends_on(writer)
+    assert not other.depends_on(reader)
+    assert overwriter.depends_on(writer)
+    assert overwriter.depends_on(reader)
+
+
+def test_Task_get_calls(tmp_path):
+    """a single PythonCall is a statement, not a callable returning
+    statements"""
+    call = pgs.PythonCall(pgs.post_run_plink, str(tmp_path), 'data')
+    assert pgs.Task(call).get_calls() == [call]
+    assert pgs.Task([call, '']).get_calls() == [call]
+    assert pgs.Task(lambda: ['echo a', call]).get_calls() == ['echo a', call]
+    assert not os.listdir(str(tmp_path))
+
+
+def test_run_tasks_dependencies(tmp_path):
+    """a task starts only after the tasks writing its inputs are done"""
+    a, b, c = [str(tmp_path / name) for name in 'abc']
+    log = str(tmp_path / 'log')
+    tasks = [
+        pgs.Task([f'sleep 0.5; echo A > {a}', f'echo a >> {log}'],
+                 outputs=[a]),
+        pgs.Task([f'cat {a} > {b}', f'echo b >> {log}'],
+                 inputs=[a], outputs=[b]),
+        pgs.Task(f'echo c >> {log}; echo C > {c}', outputs=[c])]
+    pgs.run_tasks(tasks, cores=3)
+    # the independent task finishes first, without waiting for the others
+    assert _read_lines(log) == ['c', 'a', 'b']
+    assert _read_lines(b) == ['A']
+
+
+def test_run_tasks_cores(tmp_path):
+    """tasks run concurrently only if enough cores are free"""
+    log = str(tmp_path / 'log')
+    tasks = [pgs.Task(f'echo start >> {log}; sleep 0.5; echo end >> {log}',
+                      outputs=[str(tmp_path / f'out{i}')], threads=2)
+             for i in range(2)]
+    pgs.run_tasks(tasks, cores=3)
+    assert _read_lines(log) == ['start', 'end', 'start', 'end']
+
+    os.remove(log)
+    pgs.run_tasks(tasks, cores=4)
+    assert _read_lines(log) == ['start', 'start', 'end', 'end']
+
+    # a task using more cores than available runs alone
+    os.remove(log)
+    pgs.run_tasks(tasks[:1], cores=1)
+    assert _read_lines(log) == ['start', 'end']
+
+
+def test_run_tasks_failure(tmp_path):
+    """after the first failure running tasks are terminated,
+    and no new tasks start"""
+    a, b, c = [str(tmp_path / name) for name in 'abc']
+    tasks = [
+        pgs.Task(f'sleep 30; echo A > {a}', outputs=[a]),
+        pgs.Task('sleep 0.5; exit 3', outputs=[b]),
+        pgs.Task(f'echo C > {c}', inputs=[b], outputs=[c])]
+    start = time.time()
+    with pytest.raises(subprocess.CalledProcessError) as excinfo:
+        pgs.run_tasks(tasks, cores=2)
+    assert excinfo.value.returncode == 3
+    assert time.time() - start < 10
+    assert not os.path.exists(a)
+    assert not os.path.exists(c)
+
+
+def test_batch_calls(tmp_path, monkeypatch):
+    """consecutive statements in the same container share a session"""
+    monkeypatch.setenv('SIF', str(tmp_path))
+    prefix = str(tmp_path / 'steps')
+    session = f'singularity exec --home={os.getcwd()}:/home'
+    sif = os.path.join(str(tmp_path), 'gwas.sif')
+    calls = ['$GUNZIP -c a.gz > a', '$AWK \'{print $1}\' a > b',
+             '$GZIP b']
+    assert pgs.batch_calls(calls, prefix) == [
+        f'{session} --cleanenv {sif} sh {prefix}.1.sh']
+    with open(f'{prefix}.1.sh') as f:
+        script = f.read()
+    assert 'unset BASH GUNZIP GZIP AWK PLINK PRSICE\n' in script
+    assert all(call in script for call in calls)
+
+    # $PLINK is started without --cleanenv
+    calls = ['$PLINK --bfile a --out b', '${GZIP} b.log']
+    assert pgs.batch_calls(calls, prefix) == [
+        f'{session} {sif} sh {prefix}.1.sh']
+
+
+def test_batch_calls_unbatched(tmp_path, monkeypatch):
+    """statements using other variables, several containers or in
+    groups of one are returned unchanged"""
+    monkeypatch.setenv('SIF', str(tmp_path))
+    prefix = str(tmp_path / 'steps')
+    calls = ['$GZIP a', '$GZIP b',
+             '$RSCRIPT $ROOT_DIR/script.R', '$RSCRIPT script.R',
+             '$PLINK --bfile a | $PYTHON -c "import sys"',
+             '$GUNZIP c.gz',
+             pgs.PythonCall(pgs.post_run_plink, 'out', 'data'),
+             'echo done']
+    batched = pgs.batch_calls(calls, prefix)
+    assert batched[0].endswith(f'gwas.sif sh {prefix}.1.sh')
+    assert batched[1:] == calls[2:]
+    assert os.listdir(str(tmp_path)) == ['steps.1.sh']
+
+
+def test_batch_calls_script_status(tmp_path, monkeypatch):
+    """the step script stops at the first failed step, exiting with its
+    status"""
+    monkeypatch.setenv('SIF', str(tmp_path))
+    prefix = str(tmp_path / 'steps')
+    log = str(tmp_path / 'log')
+    calls = [f'$AWK \'BEGIN {{print "a"}}\' >> {log}',
+             f'$BASH -c "exit 3"; echo b >> {log}',
+             '$AWK \'BEGIN {exit 4}\'',
+             f'$AWK \'BEGIN {{print "c"}}\' >> {log}']
+    pgs.batch_calls(calls, prefix)
+    proc = subprocess.run(['sh', f'{prefix}.1.sh'], capture_output=True,
+                          text=True)
+    assert proc.returncode == 4
+    assert _read_lines(log) == ['a', 'b']
+    assert proc.stdout.splitlines() == [
+        f'step {i} of 4 in gwas.sif exited with status {status}'
+        for i, status in [(1, 0), (2, 0), (3, 4)]]
+
+
+def _write_source(fname):
+    with gzip.open(fname, 'wt') as f:
+        f.write('SNP A1 P OR\n'
+                'rs1 A 0.5 NA\n'
+                'rs2 G NA 1.2\n'
+                'rs3 T 1e-8 .\n')
+
+
+def test_df_colums_to_file(tmp_path):
+    """a gzip source read in chunks is written to several outputs, with a
+    single header, columns in the requested order and NA tokens kept"""
+    source = str(tmp_path / 'source.gz')
+    _write_source(source)
+    outputs = [str(tmp_path / 'all.txt'), str(tmp_path / 'cols.gz')]
+    pgs.df_colums_to_file(source, outputs, [None, ['P', 'SNP', 'OR']],
+                          chunksize=1)
+    with open(outputs[0]) as f:
+        assert f.read() == ('SNP A1 P OR\n'
+                            'rs1 A 0.5 NA\n'
+                            'rs2 G NA 1.2\n'
+                            'rs3 T 1e-8 .\n')
+    with gzip.open(outputs[1], 'rt') as f:
+        assert f.read() == ('P SNP OR\n'
+                            '0.5 rs1 NA\n'
+                            'NA rs2 1.2\n'
+                            '1e-8 rs3 .\n')
+
+
+def test_PythonCall_shell_form(tmp_path):
+    """the str value of PythonCall runs the same function via $PYTHON"""
+    source = str(tmp_path / 'source.gz')
+    _write_source(source)
+    outputs = {how: [str(tmp_path / f'{how}_{what}.txt')
+                     for what in ['all', 'cols']]
+               for how in ['call', 'shell']}
+    calls = {how: pgs.PythonCall(pgs.df_colums_to_file, source, fnames,
+                                 [None, ['SNP', 'P']])
+             for how, fnames in outputs.items()}
+    assert calls['shell'].startswith('$PYTHON -c ')
+    calls['call']()
+    env = dict(os.environ, PYTHON=sys.executable, PYTHONPATH=os.path.dirname(
+        os.path.dirname(os.path.abspath(pgs.__file__))))
+    subprocess.run(calls['shell'], shell=True, check=True, env=env)
+    for call_file, shell_file in zip(outputs['call'], outputs['shell']):
+        assert _read_file(shell_file) == _read_file(call_file)
+    assert _read_lines(outputs['shell'][1]) == [
+        'SNP', 'P', 'rs1', '0.5', 'rs2', 'NA', 'rs3', '1e-8']
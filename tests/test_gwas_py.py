@@ -4,6 +4,7 @@
 Test module for ``gwas.py`` script
 """
 
+import json
 import os
 import subprocess
 import tempfile
@@ -161,3 +162,360 @@ def test_gwas_py_custom_IIDs():
         out = subprocess.run(call.split(" "))
         assert out.returncode == 0
         os.chdir(cwd)
+
+
+# py.test tests/test_gwas_py.py -k test_gwas_py_pheno_cache
+def test_gwas_py_pheno_cache():
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'gwas.py')} {d}")
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'config.yaml')} {d}")
+        os.system(f"cp {os.path.join(ref, 'example_3chr.pheno')} {d}")
+        os.system(f"cp {os.path.join(ref, 'example_3chr.pheno.dict')} {d}")
+        os.system(f"cp {os.path.join(ref, 'example_3chr.bed')} {d}")
+        os.system(f"cp {os.path.join(ref, 'example_3chr.fam')} {d}")
+        for out_prefix in ["run_text", "run_cache1", "run_cache2"]:
+            call = (
+                f"apptainer exec --home {d}:/home {p3_sif} python"
+                " gwas.py gwas --pheno-file example_3chr.pheno --geno-fit-file"
+                " example_3chr.bed --geno-file example_3chr.bed --chr2use 1-3"
+                " --analysis regenie --pheno PHENO PHENO2 --covar PC1 PC2 BATCH"
+                f" --out {out_prefix}"
+            )
+            if out_prefix != "run_text":
+                call += " --pheno-cache pheno_cache"
+            out = subprocess.run(call.split(" "))
+            assert out.returncode == 0
+        assert len(os.listdir("pheno_cache")) == 1
+        for suffix in [".pheno", ".covar"]:
+            with open("run_text" + suffix) as f:
+                expected = f.read()
+            for out_prefix in ["run_cache1", "run_cache2"]:
+                with open(out_prefix + suffix) as f:
+                    assert f.read() == expected
+        os.chdir(cwd)
+
+
+# py.test tests/test_gwas_py.py -k test_gwas_py_resume
+def test_gwas_py_resume():
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'gwas.py')} {d}")
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'config.yaml')} {d}")
+        # tools that succeed without producing outputs: all tasks get stamp files, but regenie
+        # step1 is stale as its output (run_resume.step1_pred.list) is missing, and so are the
+        # jobs that depend on it; plink2 --freq/--hardy/--missing job is up to date
+        env = dict(os.environ, REGENIE="true", PLINK2="true", PYTHON="true")
+        call = (
+            f"apptainer exec -B {ref} --home {d}:/home {p3_sif} python"
+            " gwas.py gwas --argsfile"
+            f" {os.path.join(ref, 'example_3chr.argsfile')} --pheno PHENO"
+            " --covar PC1 PC2 BATCH --analysis regenie --executor local"
+            " --out run_resume"
+        )
+        for extra_args in ["", " --resume"]:
+            out = subprocess.run((call + extra_args).split(" "), env=env)
+            assert out.returncode == 0
+        assert os.path.isfile("run_resume.regenie_step1.done")
+        with open("run_resume_submit.sh") as f:
+            submit_jobs = f.read().split("\n")[1:-1]
+        assert [job.split("=")[0] for job in submit_jobs] == [
+            "RES_regenie_step1",
+            "RES_regenie_step2",
+            "RES_regenie_merge",
+        ]
+        os.chdir(cwd)
+
+
+# py.test tests/test_gwas_py.py -k test_gwas_py_step1_cache
+def test_gwas_py_step1_cache():
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'gwas.py')} {d}")
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'config.yaml')} {d}")
+        call = (
+            f"apptainer exec -B {ref} --home {d}:/home {p3_sif} python"
+            " gwas.py gwas --argsfile"
+            f" {os.path.join(ref, 'example_3chr.argsfile')} --pheno PHENO"
+            " --covar PC1 PC2 BATCH --analysis regenie --step1-cache step1_cache"
+        )
+        out = subprocess.run((call + " --out run_step1").split(" "))
+        assert out.returncode == 0
+        (cache_entry,) = os.listdir("step1_cache")
+        with open("run_step1_submit.sh") as f:
+            assert "RES_regenie_step1=" in f.read()
+
+        # emulate completed step1 job; another run with different step2
+        # filters and chromosomes uses cached predictions
+        with open(os.path.join("step1_cache", cache_entry, "step1_pred.list"), "w") as f:
+            f.write("PHENO step1_1.loco\n")
+        out = subprocess.run((call + " --out run_step2 --chr2use 1-2 --maf 0.05").split(" "))
+        assert out.returncode == 0
+        assert os.listdir("step1_cache") == [cache_entry]
+        assert os.path.isfile("run_step2.step1_pred.list")
+        with open("run_step2_submit.sh") as f:
+            assert "RES_regenie_step1=" not in f.read()
+        os.chdir(cwd)
+
+
+# py.test tests/test_gwas_py.py -k test_gwas_py_qc_cache
+def test_gwas_py_qc_cache():
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'gwas.py')} {d}")
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'config.yaml')} {d}")
+        call = (
+            f"apptainer exec -B {ref} --home {d}:/home {p3_sif} python"
+            " gwas.py gwas --argsfile"
+            f" {os.path.join(ref, 'example_3chr.argsfile')} --pheno PHENO"
+            " --covar PC1 PC2 BATCH --analysis plink2 --chr2use 1-3"
+            " --qc-cache qc_cache"
+        )
+        out = subprocess.run((call + " --out run_qc1").split(" "))
+        assert out.returncode == 0
+        (cache_entry,) = os.listdir("qc_cache")
+        with open("run_qc1_submit.sh") as f:
+            assert "RES_plink2_info=" in f.read()
+
+        # emulate completed QC job for chromosomes 1 and 2
+        for chri in ["1", "2"]:
+            for suffix in [".afreq", ".hardy", ".vmiss"]:
+                open(os.path.join("qc_cache", cache_entry, "chr" + chri + suffix), "w").close()
+        out = subprocess.run((call + " --out run_qc2 --chr2use 1-2").split(" "))
+        assert out.returncode == 0
+        with open("run_qc2_submit.sh") as f:
+            assert "RES_plink2_info=" not in f.read()
+        with open("run_qc2_cmd.sh") as f:
+            assert os.path.join(cache_entry, "chr@") in f.read()
+        os.chdir(cwd)
+
+
+# py.test tests/test_gwas_py.py -k test_gwas_py_vcf_cache
+def test_gwas_py_vcf_cache():
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'gwas.py')} {d}")
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'config.yaml')} {d}")
+        for chri in ["1", "2"]:
+            with open(f"example_chr{chri}.vcf", "w") as f:
+                f.write("##fileformat=VCFv4.2\n")
+        call = (
+            f"apptainer exec -B {ref} --home {d}:/home {p3_sif} python"
+            " gwas.py gwas --pheno-file"
+            f" {os.path.join(ref, 'example_3chr.pheno')} --fam"
+            f" {os.path.join(ref, 'example_3chr.fam')} --geno-file example_chr@.vcf"
+            " --chr2use 1-2 --pheno PHENO --analysis plink2 --vcf-cache vcf_cache"
+        )
+        out = subprocess.run((call + " --out run_vcf1").split(" "))
+        assert out.returncode == 0
+        (cache_entry,) = os.listdir("vcf_cache")
+        with open("run_vcf1_submit.sh") as f:
+            assert "RES_vcf_to_pgen=" in f.read()
+
+        # emulate completed conversion job
+        for chri in ["1", "2"]:
+            for suffix in [".pgen", ".pvar", ".psam"]:
+                open(os.path.join("vcf_cache", cache_entry, "chr" + chri + suffix), "w").close()
+        out = subprocess.run((call + " --out run_vcf2").split(" "))
+        assert out.returncode == 0
+        with open("run_vcf2_submit.sh") as f:
+            assert "RES_vcf_to_pgen=" not in f.read()
+        with open("run_vcf2_cmd.sh") as f:
+            assert "--vcf " not in f.read()
+        os.chdir(cwd)
+
+
+# py.test tests/test_gwas_py.py -k test_gwas_py_pheno_batches
+def test_gwas_py_pheno_batches():
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'gwas.py')} {d}")
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'config.yaml')} {d}")
+        call = (
+            f"apptainer exec -B {ref} --home {d}:/home {p3_sif} python"
+            " gwas.py gwas --argsfile"
+            f" {os.path.join(ref, 'example_3chr.argsfile')} --pheno PHENO CASE"
+            " PHENO2 CASE2 --covar PC1 PC2 BATCH --analysis regenie --out run_batches"
+        )
+        out = subprocess.run(call.split(" "))
+        assert out.returncode == 0
+        expected_files = [
+            "run_batches_b1.pheno",
+            "run_batches_b1.covar",
+            "run_batches_b2.pheno",
+            "run_batches_b2.covar",
+            "run_batches_submit.sh",
+        ]
+        assert all(map(os.path.isfile, expected_files))
+        with open("run_batches_b1.pheno") as f:
+            assert f.readline().split() == ["FID", "IID", "PHENO", "PHENO2"]
+        with open("run_batches_b2.pheno") as f:
+            assert f.readline().split() == ["FID", "IID", "CASE", "CASE2"]
+        with open("run_batches_submit.sh") as f:
+            submit = f.read()
+        assert "RES_regenie_step1_b1=" in submit
+        assert "RES_regenie_step1_b2=" in submit
+        os.chdir(cwd)
+
+
+# py.test tests/test_gwas_py.py -k test_gwas_py_plan
+def test_gwas_py_plan():
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'gwas.py')} {d}")
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'config.yaml')} {d}")
+        with open("manifest.yaml", "w") as f:
+            f.write(
+                "defaults:\n"
+                f"  argsfile: {os.path.join(ref, 'example_3chr.argsfile')}\n"
+                "  covar: [PC1, PC2]\n"
+                "  analysis: [regenie]\n"
+                "cohorts:\n"
+                "  - name: COHORT1\n"
+                "  - name: COHORT2\n"
+                "traits:\n"
+                "  - name: continuous\n"
+                "    pheno: [PHENO, PHENO2]\n"
+                "  - name: binary\n"
+                "    pheno: CASE\n"
+            )
+        call = (
+            f"apptainer exec -B {ref} --home {d}:/home {p3_sif} python"
+            " gwas.py plan --manifest manifest.yaml --out plan"
+        )
+        out = subprocess.run(call.split(" "))
+        assert out.returncode == 0
+        expected_files = [
+            "plan_submit.sh",
+            "plan_cmd.sh",
+            "plan/COHORT1/continuous.pheno",
+            "plan/COHORT1/continuous_submit.sh",
+            "plan/COHORT1/binary.pheno",
+            "plan/COHORT2/continuous.pheno",
+            "plan/COHORT2/binary_submit.sh",
+        ]
+        assert all(map(os.path.isfile, expected_files))
+        with open("plan/COHORT2/binary.pheno") as f:
+            assert f.readline().split() == ["FID", "IID", "CASE"]
+        with open("plan_submit.sh") as f:
+            assert "bash plan/COHORT2/binary_submit.sh" in f.read()
+        os.chdir(cwd)
+
+
+# py.test tests/test_gwas_py.py -k test_gwas_py_trace
+def test_gwas_py_trace():
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'gwas.py')} {d}")
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'config.yaml')} {d}")
+        env = dict(os.environ, REGENIE="true", PLINK2="true", PYTHON="true")
+        call = (
+            f"apptainer exec -B {ref} --home {d}:/home {p3_sif} python"
+            " gwas.py gwas --argsfile"
+            f" {os.path.join(ref, 'example_3chr.argsfile')} --pheno PHENO"
+            " --covar PC1 PC2 BATCH --analysis regenie --executor local"
+            " --out run_trace"
+        )
+        out = subprocess.run(call.split(" "), env=env)
+        assert out.returncode == 0
+        with open("run_trace.trace.jsonl") as f:
+            trace = [json.loads(line) for line in f]
+        # regenie step1, 3 tasks of plink2 --freq/--hardy/--missing and
+        # regenie step2, and the merge
+        assert len(trace) == 8
+        assert all(record["exit_code"] == 0 for record in trace)
+        assert all(record["max_rss_mb"] > 0 for record in trace)
+        assert "regenie_step2[1]" in [record["step"] for record in trace]
+        with open("run_trace.log") as f:
+            assert "slowest tasks" in f.read()
+        os.chdir(cwd)
+
+
+# py.test tests/test_gwas_py.py -k test_gwas_py_merge_multiple_pheno
+def test_gwas_py_merge_multiple_pheno():
+    demo = os.path.join(cwd, "usecases", "gwas_demo")
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'gwas.py')} {d}")
+        for chri in ["1", "2", "3"]:
+            for pheno in ["PHENO", "PHENO2"]:
+                os.system(f"cp {os.path.join(demo, f'run2_chr{chri}_PHENO.regenie')} run2_chr{chri}_{pheno}.regenie")
+        call = (
+            f"apptainer exec --home {d}:/home {p3_sif} python"
+            " gwas.py merge-regenie --sumstats run2_chr@_{pheno}.regenie"
+            " --pheno PHENO PHENO2 --chr2use 1-3 --out run2 --log run2.merge.log"
+        )
+        out = subprocess.run(call.split(" "))
+        assert out.returncode == 0
+        expected_files = [
+            "run2.merge.log",
+            "run2_PHENO.gz",
+            "run2_PHENO.summary.json",
+            "run2_PHENO2.gz",
+            "run2_PHENO2.summary.json",
+        ]
+        assert all(map(os.path.isfile, expected_files))
+        os.chdir(cwd)
+
+
+# py.test tests/test_gwas_py.py -k test_gwas_py_merge_regenie
+def test_gwas_py_merge_regenie():
+    demo = os.path.join(cwd, "usecases", "gwas_demo")
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'gwas.py')} {d}")
+        for chri in ["1", "2", "3"]:
+            os.system(f"cp {os.path.join(demo, f'run2_chr{chri}_PHENO.regenie')} {d}")
+        call = (
+            f"apptainer exec --home {d}:/home {p3_sif} python"
+            " gwas.py merge-regenie --sumstats run2_chr@_PHENO.regenie"
+            " --chr2use 1-3 --chunksize 100 --threads 2 --out run2_PHENO"
+        )
+        out = subprocess.run(call.split(" "))
+        assert out.returncode == 0
+        expected_files = [
+            "run2_PHENO.gz",
+            "run2_PHENO.gz.tbi",
+            "run2_PHENO.README.txt",
+            "run2_PHENO.summary.json",
+        ]
+        assert all(map(os.path.isfile, expected_files))
+        os.chdir(cwd)
+
+
+# py.test tests/test_gwas_py.py -k test_gwas_py_figures_parquet
+def test_gwas_py_figures_parquet():
+    # partitions of the dataset are read in string order (CHR=1, CHR=10, CHR=2, CHR=X), while chromosomes of the
+    # manhattan plot must follow natural order; NaN P values are dropped, and P values out of (0, 1] are clipped
+    script = (
+        "import os, numpy as np, pyarrow as pa, pyarrow.parquet as pq\n"
+        "import gwas\n"
+        "for chri in ['2', 'X', '10', '1']:\n"
+        "    os.makedirs('run_PHENO.parquet/CHR={}'.format(chri))\n"
+        "    pval = np.concatenate([np.linspace(1e-10, 1, 96), [0, -1, 1.5, np.nan]])\n"
+        "    pq.write_table(pa.table({'BP': np.arange(1, 101) * 1000, 'P': pval}),\n"
+        "                   'run_PHENO.parquet/CHR={}/part-0.parquet'.format(chri))\n"
+        "binner = gwas.PvalueBinner(1e-3)\n"
+        "for df in gwas.read_sumstats_columns('run_PHENO.parquet', ['CHR', 'BP', 'P'], 1000):\n"
+        "    binner.add(df['CHR'].astype(str).values, df['BP'].values, df['P'].values.astype(np.float64))\n"
+        "binner.finalize()\n"
+        "assert list(binner.chromosomes) == ['1', '2', '10', 'X'], list(binner.chromosomes)\n"
+        "assert binner.n == 4 * 99, binner.n\n"
+    )
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        os.system(f"cp {os.path.join(cwd, 'scripts', 'gwas', 'gwas.py')} {d}")
+        with open("make_dataset.py", "w") as f:
+            f.write(script)
+        call = f"apptainer exec --home {d}:/home {p3_sif} python make_dataset.py"
+        out = subprocess.run(call.split(" "))
+        assert out.returncode == 0
+        call = (
+            f"apptainer exec --home {d}:/home {p3_sif} python"
+            " gwas.py figures --sumstats run_PHENO.parquet --title PHENO --out run_PHENO"
+        )
+        out = subprocess.run(call.split(" "))
+        assert out.returncode == 0
+        expected_files = ["run_PHENO.qq.png", "run_PHENO.qq.png.json", "run_PHENO.manh.png"]
+        assert all(map(os.path.isfile, expected_files))
+        os.chdir(cwd)